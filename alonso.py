@@ -1,32 +1,723 @@
+import argparse
+import array
 import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
 import functools
+import heapq
+import io
 import itertools
+import json
 import math
+import multiprocessing
+import os
 import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import types
+import unicodedata
+import urllib.parse
+import weakref
 import discord
-import youtube_dl
 import datetime as dt 
 
-from aiohttp import request
+import aiohttp
 from discord.ext import commands, tasks
 from async_timeout import timeout
 from discord.ext.commands import Cog 
 
-# Silence useless bug reports messages
-youtube_dl.utils.bug_reports_message = lambda: ''
+import extraction
+from extraction import YTDLError
 
 
 class VoiceError(Exception):
     pass
 
 
-class YTDLError(Exception):
-    pass
+class Metrics:
+    """Counters and histograms, served in the Prometheus text format.
+
+    Recording is a dict lookup and an addition, cheap enough to leave on. It
+    happens on worker threads too (snapshot flushes, the loop watchdog), so
+    updates and scrapes share a lock. Gauges aren't tracked at all:
+    ``collectors`` are asked for their current values when the endpoint is
+    scraped.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.collectors = []
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        # (name, labels) -> per-bucket counts, the +Inf bucket, then the sum
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name: str, value: float, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+
+            histogram[bisect.bisect_left(self.BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _labels(labels: tuple):
+        if not labels:
+            return ''
+
+        return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                               .replace('\n', '\\n'))
+                              for key, value in labels) + '}'
+
+    def render(self):
+        lines, typed = [], set()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(histogram)) for key, histogram in self._histograms.items())
+
+        def declare(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append('{}{} {}'.format(name, self._labels(labels), value))
+
+        for (name, labels), histogram in histograms:
+            declare(name, 'histogram')
+            count = 0
+            for bound, hits in zip(self.BUCKETS + ('+Inf',), histogram):
+                count += hits
+                lines.append('{}_bucket{} {}'.format(name, self._labels(labels + (('le', bound),)), count))
+            lines.append('{}_sum{} {}'.format(name, self._labels(labels), histogram[-1]))
+            lines.append('{}_count{} {}'.format(name, self._labels(labels), count))
+
+        for collector in self.collectors:
+            for name, value in collector().items():
+                declare(name, 'gauge')
+                lines.append('{} {}'.format(name, value))
+
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host: str, port: int):
+        from aiohttp import web
+
+        async def scrape(request):
+            return web.Response(body=self.render().encode(),
+                                headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+        app = web.Application()
+        app.router.add_get('/metrics', scrape)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+metrics = Metrics()
+
+
+class MetadataCache:
+    """LRU cache of resolved youtube_dl info dicts.
+
+    Entries are keyed by the normalized search string and by ``webpage_url``
+    and expire together with the stream URL they carry. Concurrent lookups of
+    the same key share a single in-flight extraction.
+    """
+
+    # Stream URLs are signed for ~6 hours; stop handing them out a bit early.
+    DEFAULT_TTL = 6 * 60 * 60
+    EXPIRY_MARGIN = 10 * 60
+
+    def __init__(self, maxsize: int = 1024, ttl: float = DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._pending = {}
+        self._waiters = collections.Counter()
+
+    @staticmethod
+    def search_key(search: str):
+        return 'search:' + ' '.join(search.split()).casefold()
+
+    def ttl_for(self, info: dict):
+        ttl = self.ttl
+        query = urllib.parse.urlparse(info.get('url') or '').query
+        expire = urllib.parse.parse_qs(query).get('expire')
+        if expire:
+            try:
+                ttl = min(ttl, int(expire[0]) - time.time())
+            except ValueError:
+                pass
+
+        return ttl - self.EXPIRY_MARGIN
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, info = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return info
+
+    def put(self, info: dict, *keys: str):
+        ttl = self.ttl_for(info)
+        if ttl <= 0:
+            return
+
+        expires = time.monotonic() + ttl
+        for key in keys:
+            if key:
+                self._entries[key] = (expires, info)
+                self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def fetch(self, key: str, factory, *, loop: asyncio.BaseEventLoop = None):
+        info = self.get(key)
+        if info is not None:
+            metrics.inc('alonso_metadata_cache_total', result='hit')
+            return info
+
+        task = self._pending.get(key)
+        if task is not None:
+            metrics.inc('alonso_metadata_cache_total', result='shared')
+        else:
+            metrics.inc('alonso_metadata_cache_total', result='miss')
+            loop = loop or asyncio.get_event_loop()
+            task = loop.create_task(factory())
+            self._pending[key] = task
+            task.add_done_callback(functools.partial(self._finish, key))
+
+        # Shield so one abandoned command doesn't cancel everybody's lookup;
+        # the extraction itself is only cancelled once nobody waits for it.
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] <= 0:
+                del self._waiters[key]
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self._pending.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            info = task.result()
+            self.put(info, key, info.get('webpage_url'))
+
+    def clear(self):
+        self._entries.clear()
+
+
+class ExtractionEngine:
+    """Runs youtube_dl extraction in a pool of warm worker processes.
+
+    Each worker builds its own ``YoutubeDL`` once, so the parsing work never
+    holds the bot's GIL. Calls are bounded by a timeout and by a per-guild
+    concurrency cap. With ``workers=0`` extraction runs in the loop's default
+    thread pool instead.
+    """
+
+    def __init__(self, options: dict, *, workers: int = 2, timeout: float = 30.0, per_guild: int = 2):
+        self.options = options
+        self.workers = workers
+        self.timeout = timeout
+        self.per_guild = per_guild
+
+        self._executor = None
+        self._guild_limits = weakref.WeakValueDictionary()
+
+    @property
+    def executor(self):
+        if self._executor is None and self.workers > 0:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=extraction.init,
+                initargs=(self.options,))
+
+        return self._executor
+
+    def _guild_limit(self, guild_id: int):
+        limit = self._guild_limits.get(guild_id)
+        if limit is None:
+            limit = asyncio.Semaphore(self.per_guild)
+            self._guild_limits[guild_id] = limit
+
+        return limit
+
+    def _run_local(self, func, *args):
+        if extraction.ytdl is None:
+            extraction.init(self.options)
+
+        return func(*args)
+
+    async def _run(self, func, url: str, *args, guild_id: int, loop: asyncio.BaseEventLoop):
+        loop = loop or asyncio.get_event_loop()
+        kind = 'playlist' if func is extraction.extract_playlist else 'track'
+
+        # Keep a strong reference while waiting so the semaphore isn't collected.
+        limit = self._guild_limit(guild_id)
+        queued = time.perf_counter()
+        async with limit:
+            start = time.perf_counter()
+            metrics.observe('alonso_extraction_wait_seconds', start - queued, kind=kind)
+
+            if self.executor is None:
+                future = loop.run_in_executor(None, self._run_local, func, url, *args)
+            else:
+                future = loop.run_in_executor(self.executor, func, url, *args)
+
+            # A call already running in a worker can't be interrupted; on
+            # timeout or cancellation its result is simply dropped.
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                metrics.inc('alonso_extraction_errors_total', kind=kind, error='timeout')
+                raise YTDLError('`{}` çok uzun sürdü, vazgeçtim'.format(url))
+            except concurrent.futures.process.BrokenProcessPool:
+                metrics.inc('alonso_extraction_errors_total', kind=kind, error='broken_pool')
+                self._executor = None
+                raise YTDLError('Arama işçileri çöktü, tekrar dene')
+            finally:
+                metrics.observe('alonso_extraction_seconds', time.perf_counter() - start, kind=kind)
+
+    async def extract(self, url: str, *, process: bool = True, fields: tuple = None, guild_id: int = None,
+                      loop: asyncio.BaseEventLoop = None):
+        return await self._run(extraction.extract, url, process, fields, guild_id=guild_id, loop=loop)
+
+    async def extract_playlist(self, url: str, *, limit: int, guild_id: int = None,
+                               loop: asyncio.BaseEventLoop = None):
+        return await self._run(extraction.extract_playlist, url, limit, guild_id=guild_id, loop=loop)
+
+    async def warm(self, *, loop: asyncio.BaseEventLoop = None):
+        """Spawns all workers (and so loads youtube_dl) up front so the first ``!play`` doesn't pay for it."""
+
+        loop = loop or asyncio.get_event_loop()
+        if self.executor is None:
+            if extraction.ytdl is None:
+                await loop.run_in_executor(None, extraction.init, self.options)
+            return
+
+        await asyncio.gather(*(loop.run_in_executor(self.executor, time.sleep, 0.1)
+                               for _ in range(self.workers)))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class AudioCache:
+    """Size-bounded on-disk cache of Opus-encoded tracks.
+
+    Files are named after the ``outtmpl`` id scheme (``extractor-id``), so a
+    track is cached once no matter how it was searched for. Tracks are
+    downloaded in the background once they've been played ``min_plays``
+    times, written to a ``.part`` file and renamed into place, and the least
+    recently played files are evicted when the directory outgrows
+    ``max_bytes``.
+    """
+
+    def __init__(self, directory: str = 'audio_cache', *, max_bytes: int = 2 * 1024 ** 3, min_plays: int = 2,
+                 max_duration: int = 20 * 60, downloads: int = 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.max_duration = max_duration
+        self.downloads = downloads
+
+        self.size = 0
+        self._entries = None
+        self._plays = collections.OrderedDict()
+        self._pending = {}
+        self._download_limit = None
+
+    def _load(self):
+        if self._entries is not None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.part'):
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        self._entries = collections.OrderedDict((name, size) for _, name, size in sorted(files))
+        self.size = sum(self._entries.values())
+
+    @staticmethod
+    def key(data: dict):
+        if not data.get('id'):
+            return None
+
+        return re.sub(r'[^\w-]', '_', '{}-{}'.format(data.get('extractor', 'generic'), data['id'])) + '.opus'
+
+    def get(self, data: dict):
+        """Returns the cached file for ``data`` and marks it as recently used."""
+
+        self._load()
+        key = self.key(data)
+        if key not in self._entries:
+            return None
+
+        path = os.path.join(self.directory, key)
+        self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.size -= self._entries.pop(key)
+            return None
+
+        return path
+
+    def __contains__(self, data: dict):
+        self._load()
+        return self.key(data) in self._entries
+
+    def record_play(self, data: dict, *, loop: asyncio.BaseEventLoop = None):
+        self._load()
+        key = self.key(data)
+        if key is None or key in self._entries or key in self._pending:
+            return
+
+        duration = data.get('duration')
+        if not data.get('url') or not duration or duration > self.max_duration:
+            return
+
+        plays = self._plays.pop(key, 0) + 1
+        if plays < self.min_plays:
+            self._plays[key] = plays
+            while len(self._plays) > 10000:
+                self._plays.popitem(last=False)
+            return
+
+        loop = loop or asyncio.get_event_loop()
+        task = loop.create_task(self._download(key, data))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def _download(self, key: str, data: dict):
+        if self._download_limit is None:
+            self._download_limit = asyncio.Semaphore(self.downloads)
+
+        path = os.path.join(self.directory, key)
+        part = path + '.part'
+        codec = ['-c:a', 'copy'] if data.get('acodec') == 'opus' else ['-c:a', 'libopus', '-b:a', '128k']
+
+        async with self._download_limit:
+            process = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+                *YTDLSource.FFMPEG_OPTIONS['before_options'].split(), '-i', data['url'],
+                '-vn', *codec, '-f', 'opus', part,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+            try:
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                returncode = None
+                raise
+            finally:
+                if returncode != 0 and os.path.exists(part):
+                    os.remove(part)
+
+        if returncode != 0:
+            return
+
+        os.replace(part, path)
+        self._entries[key] = os.path.getsize(path)
+        self.size += self._entries[key]
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.directory, key))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        for task in list(self._pending.values()):
+            task.cancel()
+
+
+class PlayHistory:
+    """Search index over every track the bot has played.
+
+    Titles, uploaders and tags are split into accent-folded tokens ("şımarık"
+    and "simarik" are the same) in an inverted index of compact ``array``
+    postings; titles and URLs stay in SQLite. A search scores tracks by the
+    IDF weight of the query tokens they contain, with the last token allowed
+    to be a prefix for autocomplete, and boosts the ones the guild plays
+    most. ``lookup`` only answers when one track clearly wins, so anything
+    ambiguous still goes to YouTube.
+    """
+
+    TAGS = 8
+    # Tokens in more tracks than this ("official", "video") are skipped.
+    COMMON = 20000
+    PREFIXES = 32
+    # How far the best match has to beat the runner-up to skip YouTube.
+    CONFIDENCE = 1.5
+    MAX_GUILDS = 1000
+
+    COMBINING = re.compile('[\u0300-\u036f]')
+    WORD = re.compile(r'\w+')
+
+    def __init__(self, store: 'StateStore'):
+        self.store = store
+        self.ready = False
+
+        self._postings = {}
+        self._vocabulary = []
+        self._title_lengths = array.array('B')
+        self._tracks = 0
+        self._guilds = collections.OrderedDict()
+        self._loading = None
+        self._backlog = []
+
+    def __len__(self):
+        return self._tracks
+
+    @classmethod
+    def tokens(cls, text: str):
+        text = cls.COMBINING.sub('', unicodedata.normalize('NFKD', fold(text or '')))
+        return list(dict.fromkeys(cls.WORD.findall(text)))
+
+    def _add(self, postings: dict, lengths: array.array, track_id: int, title: str, uploader: str, tags: str):
+        title_tokens = self.tokens(title)
+        if len(lengths) <= track_id:
+            lengths.extend(bytes(track_id + 1 - len(lengths)))
+        lengths[track_id] = max(1, min(len(title_tokens), 255))
+
+        new = []
+        for token in dict.fromkeys(title_tokens + self.tokens(uploader) + self.tokens(tags)):
+            track_ids = postings.get(token)
+            if track_ids is None:
+                track_ids = postings[token] = array.array('I')
+                new.append(token)
+            track_ids.append(track_id)
+
+        return new
+
+    def _build(self):
+        postings, lengths, tracks = {}, array.array('B'), 0
+        for row in self.store.tracks():
+            self._add(postings, lengths, *row)
+            tracks += 1
+
+        return postings, lengths, sorted(postings), tracks
+
+    def warm(self, *, loop: asyncio.BaseEventLoop = None):
+        """Starts building the index in the background; searches find nothing until it's done."""
+
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load(loop or asyncio.get_event_loop()))
+
+        return self._loading
+
+    async def _load(self, loop: asyncio.BaseEventLoop):
+        try:
+            self._postings, self._title_lengths, self._vocabulary, self._tracks = await loop.run_in_executor(None, self._build)
+        except sqlite3.Error as e:
+            print('Play history unavailable: {}'.format(e))
+            return
+
+        # Tracks first played while the index was loading.
+        for row in self._backlog:
+            if row[0] >= len(self._title_lengths) or not self._title_lengths[row[0]]:
+                self._index(*row)
+        self._backlog = None
+        self.ready = True
+
+    def _index(self, track_id: int, title: str, uploader: str, tags: str):
+        self._tracks += 1
+        for token in self._add(self._postings, self._title_lengths, track_id, title, uploader, tags):
+            bisect.insort(self._vocabulary, token)
+
+    async def record(self, guild_id: int, data: dict, *, loop: asyncio.BaseEventLoop = None):
+        url, title = data.get('webpage_url'), data.get('title')
+        if not url or not title:
+            return
+
+        row = (title, data.get('uploader'), ' '.join((data.get('tags') or [])[:self.TAGS]))
+        loop = loop or asyncio.get_event_loop()
+        try:
+            track_id, created = await loop.run_in_executor(None, self.store.add_play, guild_id, url, *row)
+        except sqlite3.Error as e:
+            print('Could not record play: {}'.format(e))
+            return
+
+        plays = self._guilds.get(guild_id)
+        if plays is not None:
+            plays[track_id] = plays.get(track_id, 0) + 1
+
+        if created:
+            if self.ready:
+                self._index(track_id, *row)
+            elif self._backlog is not None:
+                self._backlog.append((track_id,) + row)
+
+    async def _plays(self, guild_id: int, loop: asyncio.BaseEventLoop):
+        if guild_id is None:
+            return {}
+
+        plays = self._guilds.get(guild_id)
+        if plays is None:
+            try:
+                plays = await loop.run_in_executor(None, self.store.guild_plays, guild_id)
+            except sqlite3.Error as e:
+                print('Play counts unavailable: {}'.format(e))
+                return {}
+
+            plays = self._guilds.setdefault(guild_id, plays)
+            while len(self._guilds) > self.MAX_GUILDS:
+                self._guilds.popitem(last=False)
+
+        self._guilds.move_to_end(guild_id)
+        return plays
+
+    async def _track_info(self, track_ids: list, loop: asyncio.BaseEventLoop):
+        try:
+            return await loop.run_in_executor(None, self.store.track_info, track_ids)
+        except sqlite3.Error as e:
+            print('Play history unavailable: {}'.format(e))
+            return {}
+
+    def _matches(self, word: str, prefix: bool):
+        if word in self._postings:
+            yield word, 1.0
+
+        if prefix or word not in self._postings:
+            start = bisect.bisect_left(self._vocabulary, word)
+            for token in itertools.islice(self._vocabulary, start, start + self.PREFIXES):
+                if not token.startswith(word):
+                    break
+                if token != word:
+                    yield token, 0.8
+
+    async def search(self, guild_id: int, query: str, *, limit: int = 5, prefix: bool = True,
+                     loop: asyncio.BaseEventLoop = None):
+        """Returns up to ``limit`` (track id, score, exact) tuples, best first.
+
+        ``exact`` means every query token matched a whole token of the track.
+        """
+
+        if not self.ready:
+            self.warm(loop=loop)
+            return []
+
+        words = self.tokens(query)
+        total = max(self._tracks, 1)
+        scores, matched, exact = collections.defaultdict(float), collections.Counter(), collections.Counter()
+        query_weight = 0.0
+        for i, word in enumerate(words):
+            best = {}
+            for token, factor in self._matches(word, prefix and i == len(words) - 1):
+                track_ids = self._postings[token]
+                if len(track_ids) > self.COMMON:
+                    continue
+
+                weight = factor * math.log(1 + total / len(track_ids))
+                for track_id in track_ids:
+                    if weight > best.get(track_id, (0.0,))[0]:
+                        best[track_id] = (weight, factor == 1.0)
+
+            if not best:
+                query_weight += math.log(1 + total)
+                continue
+
+            query_weight += max(weight for weight, _ in best.values())
+            for track_id, (weight, whole) in best.items():
+                scores[track_id] += weight
+                matched[track_id] += 1
+                exact[track_id] += whole
+
+        if not scores:
+            return []
+
+        plays = await self._plays(guild_id, loop or asyncio.get_event_loop())
+        ranked = []
+        for track_id, score in scores.items():
+            coverage = score / query_weight
+            precision = min(1.0, matched[track_id] / self._title_lengths[track_id])
+            ranked.append((coverage * (0.85 + 0.15 * precision) * (1 + 0.25 * math.log1p(plays.get(track_id, 0))),
+                           track_id, exact[track_id] == len(words) and precision >= 0.5))
+
+        return [(track_id, score, confident) for score, track_id, confident in heapq.nlargest(limit, ranked)]
+
+    async def lookup(self, guild_id: int, query: str, *, loop: asyncio.BaseEventLoop = None):
+        """The webpage_url of the one track ``query`` must mean, or None."""
+
+        loop = loop or asyncio.get_event_loop()
+        results = await self.search(guild_id, query, limit=2, prefix=False, loop=loop)
+        if not results or not results[0][2]:
+            metrics.inc('alonso_history_lookups_total', result='miss')
+            return None
+
+        if len(results) > 1 and results[0][1] < self.CONFIDENCE * results[1][1]:
+            metrics.inc('alonso_history_lookups_total', result='ambiguous')
+            return None
+
+        info = (await self._track_info([results[0][0]], loop)).get(results[0][0])
+        metrics.inc('alonso_history_lookups_total', result='hit' if info else 'miss')
+        return info[0] if info else None
+
+    async def suggest(self, guild_id: int, text: str, *, limit: int = 5, loop: asyncio.BaseEventLoop = None):
+        """Autocomplete: (url, title, uploader, plays) for the best matches of a partial query."""
+
+        loop = loop or asyncio.get_event_loop()
+        results = await self.search(guild_id, text, limit=limit, loop=loop)
+        if not results:
+            return []
+
+        info = await self._track_info([track_id for track_id, _, _ in results], loop)
+        plays = await self._plays(guild_id, loop)
+        return [info[track_id] + (plays.get(track_id, 0),) for track_id, _, _ in results if track_id in info]
 
 
 class YTDLSource(discord.PCMVolumeTransformer):
     YTDL_OPTIONS = {
-        'format': 'bestaudio/best',
+        'format': 'bestaudio[acodec=opus]/bestaudio/best',
         'extractaudio': True,
         'audioformat': 'mp3',
         'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
@@ -46,23 +737,46 @@ class YTDLSource(discord.PCMVolumeTransformer):
         'options': '-vn',
     }
 
-    ytdl = youtube_dl.YoutubeDL(YTDL_OPTIONS)
+    # Everything __init__ and Song.create_embed read; the rest of the info
+    # dict (formats, subtitles, ...) is dropped inside the worker.
+    INFO_FIELDS = (
+        'id', 'extractor', 'title', 'uploader', 'uploader_url', 'upload_date', 'thumbnail', 'description',
+        'duration', 'tags', 'webpage_url', 'view_count', 'like_count', 'dislike_count', 'url', 'acodec',
+    )
+
+    # 'opus' hands ffmpeg's Opus packets straight to the voice client;
+    # 'pcm' decodes to PCM and scales the volume in Python.
+    PLAYBACK = 'opus'
 
-    def __init__(self, ctx: commands.Context, source: discord.FFmpegPCMAudio, *, data: dict, volume: float = 0.5):
+    audio_cache = AudioCache('audio_cache', max_bytes=2 * 1024 ** 3)
+
+    # Playlists are expanded flat, so this only bounds the queue, not the cost.
+    PLAYLIST_LIMIT = 500
+
+    URL_PATTERN = re.compile(r'^<?(https?://|www\.)\S+?>?$', re.IGNORECASE)
+
+    engine = ExtractionEngine(YTDL_OPTIONS, workers=2, timeout=30.0, per_guild=2)
+    cache = MetadataCache()
+    # Set up by the Music cog once the bot's database is known.
+    history = None
+
+    def __init__(self, source: discord.FFmpegPCMAudio, *, data: dict, requester: discord.Member,
+                 channel: discord.TextChannel, volume: float = 0.5, position: float = 0.0):
         super().__init__(source, volume)
 
-        self.requester = ctx.author
-        self.channel = ctx.channel
+        self.requester = requester
+        self.channel = channel
         self.data = data
+        self.start = position
+        self.frames = 0
 
         self.uploader = data.get('uploader')
         self.uploader_url = data.get('uploader_url')
-        date = data.get('upload_date')
-        self.upload_date = date[6:8] + '.' + date[4:6] + '.' + date[0:4]
+        self.upload_date = self.parse_date(data.get('upload_date'))
         self.title = data.get('title')
         self.thumbnail = data.get('thumbnail')
         self.description = data.get('description')
-        self.duration = self.parse_duration(int(data.get('duration')))
+        self.duration = self.parse_duration(int(data.get('duration') or 0))
         self.tags = data.get('tags')
         self.url = data.get('webpage_url')
         self.views = data.get('view_count')
@@ -74,45 +788,111 @@ class YTDLSource(discord.PCMVolumeTransformer):
         return '**{0.title}** şu kişi tarafından **{0.uploader}**'.format(self)
 
     @classmethod
-    async def create_source(cls, ctx: commands.Context, search: str, *, loop: asyncio.BaseEventLoop = None):
-        loop = loop or asyncio.get_event_loop()
+    def create_source(cls, song: 'Song', *, volume: float = 0.5):
+        with metrics.timer('alonso_create_source_seconds', playback=cls.PLAYBACK):
+            if cls.PLAYBACK == 'opus':
+                return YTDLOpusSource(song, volume=volume, position=song.start)
 
-        partial = functools.partial(cls.ytdl.extract_info, search, download=False, process=False)
-        data = await loop.run_in_executor(None, partial)
+            source, before_options, _ = cls.ffmpeg_input(song.data, position=song.start)
+            return cls(BufferedAudio(discord.FFmpegPCMAudio(source, before_options=before_options,
+                                                            options=cls.FFMPEG_OPTIONS['options'])),
+                       data=song.data, requester=song.requester, channel=song.channel, volume=volume,
+                       position=song.start)
 
-        if data is None:
-            raise YTDLError('Aradığınız `{}` ile eşleşen bir şey bulamadım '.format(search))
+    @property
+    def position(self):
+        return self.start + self.frames * YTDLOpusSource.FRAME_LENGTH
 
-        if 'entries' not in data:
-            process_info = data
+    def read(self):
+        data = super().read()
+        if data:
+            self.frames += 1
+
+        return data
+
+    def prebuffer(self, frames: int):
+        self.original.prebuffer(frames)
+
+    @classmethod
+    def ffmpeg_input(cls, data: dict, *, position: float = 0.0):
+        """Returns the ffmpeg input, its before_options and whether it is already Opus."""
+
+        path = cls.audio_cache.get(data)
+        if path is not None:
+            source, before_options, opus = path, '', True
         else:
-            process_info = None
-            for entry in data['entries']:
-                if entry:
-                    process_info = entry
-                    break
+            source, before_options, opus = data['url'], cls.FFMPEG_OPTIONS['before_options'], data.get('acodec') == 'opus'
 
-            if process_info is None:
-                raise YTDLError('Aradığınız `{}` ile eşleşen bir şey bulamadım'.format(search))
+        if position:
+            before_options = '-ss {:.2f} {}'.format(position, before_options).strip()
 
-        webpage_url = process_info['webpage_url']
-        partial = functools.partial(cls.ytdl.extract_info, webpage_url, download=False)
-        processed_info = await loop.run_in_executor(None, partial)
+        return source, before_options, opus
 
-        if processed_info is None:
-            raise YTDLError('Aradığınız `{}` ile eşleşen bir şey bulamadım'.format(webpage_url))
+    @classmethod
+    def is_url(cls, search: str):
+        return cls.URL_PATTERN.match(search.strip()) is not None
 
-        if 'entries' not in processed_info:
-            info = processed_info
+    @classmethod
+    def is_playlist(cls, search: str):
+        if not cls.is_url(search):
+            return False
+
+        url = urllib.parse.urlparse(search.strip().strip('<>'))
+        query = urllib.parse.parse_qs(url.query)
+        return url.path.rstrip('/').endswith(('/playlist', '/sets')) or ('list' in query and 'v' not in query)
+
+    @classmethod
+    async def extract_playlist(cls, url: str, *, guild_id: int = None, loop: asyncio.BaseEventLoop = None):
+        data = await cls.engine.extract_playlist(url.strip().strip('<>'), limit=cls.PLAYLIST_LIMIT,
+                                                 guild_id=guild_id, loop=loop)
+        if not data or not data[1]:
+            raise YTDLError('Aradığınız `{}` ile eşleşen bir şey bulamadım'.format(url))
+
+        return data
+
+    @classmethod
+    async def extract_info(cls, search: str, *, guild_id: int = None, loop: asyncio.BaseEventLoop = None):
+        loop = loop or asyncio.get_event_loop()
+
+        # Direct links resolve in one processed pass; anything else becomes a
+        # single-result search, so there's never a second extraction.
+        search = search.strip()
+        if cls.is_url(search):
+            key = query = search.strip('<>')
         else:
-            info = None
-            while info is None:
-                try:
-                    info = processed_info['entries'].pop(0)
-                except IndexError:
-                    raise YTDLError('Aradığınız `{}` ile eşleşen bir şey bulamadım'.format(webpage_url))
+            key = cls.cache.search_key(search)
+            query = 'ytsearch1:' + search
 
-        return cls(ctx, discord.FFmpegPCMAudio(info['url'], **cls.FFMPEG_OPTIONS), data=info)
+            # A search for something this guild played before goes straight to its URL.
+            if cls.history is not None and cls.cache.get(key) is None:
+                known = await cls.history.lookup(guild_id, search, loop=loop)
+                if known is not None:
+                    key = query = known
+
+        return await cls.cache.fetch(key, functools.partial(cls._resolve, search, query, guild_id, loop), loop=loop)
+
+    @classmethod
+    async def _resolve(cls, search: str, query: str, guild_id: int, loop: asyncio.BaseEventLoop):
+        data = await cls.engine.extract(query, fields=cls.INFO_FIELDS, guild_id=guild_id, loop=loop)
+
+        if data is None:
+            raise YTDLError('Aradığınız `{}` ile eşleşen bir şey bulamadım'.format(search))
+
+        if 'entries' not in data:
+            return data
+
+        for entry in data['entries']:
+            if entry:
+                return entry
+
+        raise YTDLError('Aradığınız `{}` ile eşleşen bir şey bulamadım'.format(search))
+
+    @staticmethod
+    def parse_date(date: str):
+        if not date:
+            return None
+
+        return date[6:8] + '.' + date[4:6] + '.' + date[0:4]
 
     @staticmethod
     def parse_duration(duration: int):
@@ -133,32 +913,379 @@ class YTDLSource(discord.PCMVolumeTransformer):
         return ', '.join(duration)
 
 
+class BufferedAudio(discord.AudioSource):
+    """Wraps an ffmpeg source so its first frames can be read ahead of time.
+
+    ``prebuffer`` spawns nothing new; it just pulls frames from the already
+    running ffmpeg process, so by the time the player asks for the first
+    frame ffmpeg has connected, buffered and decoded.
+    """
+
+    # Every live playback source, so stats can count ffmpeg processes.
+    instances = weakref.WeakSet()
+
+    def __init__(self, original: discord.AudioSource):
+        self.original = original
+        self._buffer = collections.deque()
+        self._lock = threading.Lock()
+        self.instances.add(self)
+
+    @classmethod
+    def running(cls):
+        count = 0
+        for source in list(cls.instances):
+            process = getattr(source.original, '_process', None)
+            if process is not None and process.poll() is None:
+                count += 1
+
+        return count
+
+    def prebuffer(self, frames: int):
+        with self._lock:
+            while len(self._buffer) < frames:
+                data = self.original.read()
+                if not data:
+                    break
+                self._buffer.append(data)
+
+    def read(self):
+        with self._lock:
+            if self._buffer:
+                return self._buffer.popleft()
+
+        return self.original.read()
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self._buffer.clear()
+        self.original.cleanup()
+
+
+class YTDLOpusSource(discord.AudioSource):
+    """Plays a song as Opus packets straight from ffmpeg.
+
+    At 100% volume, the default, an Opus stream is copied without
+    re-encoding; after a ``!volume`` change ffmpeg applies the volume as a
+    filter and encodes to Opus itself. The volume can't change mid-stream,
+    so ``with_volume`` builds a replacement source that picks up at the
+    current position.
+    """
+
+    FRAME_LENGTH = 0.02
+
+    def __init__(self, song: 'Song', *, volume: float = 1.0, position: float = 0.0):
+        self.requester = song.requester
+        self.channel = song.channel
+        self.data = song.data
+        self.song = song
+
+        self.start = position
+        self.frames = 0
+        self._volume = volume
+
+        source, before_options, opus = YTDLSource.ffmpeg_input(song.data, position=position)
+        copy = volume == 1.0 and opus
+
+        options = YTDLSource.FFMPEG_OPTIONS['options']
+        if not copy:
+            options = '{} -filter:a volume={:.2f}'.format(options, volume)
+
+        # FFmpegOpusAudio copies the stream for codec='opus'; anything else,
+        # 'copy' included, means -c:a libopus.
+        self.original = BufferedAudio(discord.FFmpegOpusAudio(source, codec='opus' if copy else None,
+                                                              before_options=before_options, options=options))
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @property
+    def position(self):
+        return self.start + self.frames * self.FRAME_LENGTH
+
+    def prebuffer(self, frames: int):
+        self.original.prebuffer(frames)
+
+    def read(self):
+        data = self.original.read()
+        if data:
+            self.frames += 1
+
+        return data
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.original.cleanup()
+
+    def with_volume(self, volume: float):
+        return type(self)(self.song, volume=volume, position=self.position)
+
+
 class Song:
-    __slots__ = ('source', 'requester')
+    """A queued track.
+
+    Only the trimmed info dict is kept while the song waits in the queue; the
+    ffmpeg source is built when it actually starts playing, and the stream URL
+    is re-resolved if it has expired in the meantime.
+    """
 
-    def __init__(self, source: YTDLSource):
-        self.source = source
-        self.requester = source.requester
+    __slots__ = ('source', 'requester', 'channel', 'data', 'expires', 'turn', 'start')
+
+    def __init__(self, data: dict, *, requester: discord.Member, channel: discord.TextChannel):
+        self.source = None
+        self.requester = requester
+        self.channel = channel
+        self.data = data
+        self.expires = self._expiry(data)
+        self.turn = 0
+        self.start = 0.0
+
+    def __str__(self):
+        return '**{0.title}** şu kişi tarafından **{0.uploader}**'.format(self)
+
+    @classmethod
+    async def from_search(cls, ctx: commands.Context, search: str, *, loop: asyncio.BaseEventLoop = None):
+        info = await YTDLSource.extract_info(search, guild_id=ctx.guild.id, loop=loop)
+        return cls(info, requester=ctx.author, channel=ctx.channel)
+
+    @classmethod
+    def placeholders(cls, ctx: commands.Context, entries: list):
+        """Yields unresolved songs for flat playlist entries."""
+
+        for url, title in entries:
+            yield cls({'webpage_url': url, 'title': title}, requester=ctx.author, channel=ctx.channel)
+
+    def snapshot(self, *, position: float = 0.0):
+        return {'data': self.data, 'requester': self.requester.id, 'channel': self.channel.id,
+                'position': round(position, 2)}
+
+    @classmethod
+    def restore(cls, entry: dict, ctx: commands.Context):
+        """Rebuilds a snapshotted song from its stored info, without extraction."""
+
+        song = cls(entry['data'], requester=ctx.guild.get_member(entry['requester']) or ctx.author,
+                   channel=ctx.guild.get_channel(entry['channel']) or ctx.channel)
+        song.start = entry.get('position', 0.0)
+        return song
+
+    @staticmethod
+    def _expiry(data: dict):
+        if not data.get('url'):
+            return 0.0
+
+        return time.monotonic() + YTDLSource.cache.ttl_for(data)
+
+    @property
+    def title(self):
+        return self.data.get('title')
+
+    @property
+    def url(self):
+        return self.data.get('webpage_url')
+
+    @property
+    def uploader(self):
+        return self.data.get('uploader')
+
+    @property
+    def stale(self):
+        return time.monotonic() >= self.expires
+
+    async def resolve(self, *, loop: asyncio.BaseEventLoop = None):
+        # A cached track plays from disk, so an expired stream URL doesn't matter.
+        if self.stale and self.data not in YTDLSource.audio_cache:
+            self.data = await YTDLSource.extract_info(self.url, guild_id=self.channel.guild.id, loop=loop)
+            self.expires = self._expiry(self.data)
+
+        return self
 
     def create_embed(self):
+        data = self.data
         embed = (discord.Embed(title='Şimdi oynatılıyor',
-                               description='```css\n{0.source.title}\n```'.format(self),
+                               description='```css\n{0.title}\n```'.format(self),
                                color=discord.Color.blurple())
-                 .add_field(name='Süre', value=self.source.duration)
+                 .add_field(name='Süre', value=YTDLSource.parse_duration(int(data.get('duration') or 0)))
                  .add_field(name='Oynatmamı isteyen kişi', value=self.requester.mention)
-                 .add_field(name='Yükleyen kişi', value='[{0.source.uploader}]({0.source.uploader_url})'.format(self))
-                 .add_field(name='URL', value='[Tıkla anam]({0.source.url})'.format(self))
-                 .set_thumbnail(url=self.source.thumbnail))
+                 .add_field(name='Yükleyen kişi', value='[{0.uploader}]({1})'.format(self, data.get('uploader_url')))
+                 .add_field(name='URL', value='[Tıkla anam]({0.url})'.format(self))
+                 .set_thumbnail(url=data.get('thumbnail')))
 
         return embed
 
 
-class SongQueue(asyncio.Queue):
+class ChunkedList:
+    """A list stored as a run of bounded chunks.
+
+    Indexing finds the chunk with a binary search over cached chunk offsets,
+    and inserts/deletes only shift elements inside one chunk, so large queues
+    stay cheap to index, edit and page through.
+    """
+
+    CHUNK_SIZE = 256
+
+    def __init__(self, iterable=()):
+        self._chunks = []
+        self._offsets = []
+        self._len = 0
+        self.extend(iterable)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def _reindex(self):
+        offsets, total = [], 0
+        for chunk in self._chunks:
+            offsets.append(total)
+            total += len(chunk)
+
+        self._offsets = offsets
+
+    def _locate(self, index: int):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('ChunkedList index out of range')
+
+        if self._offsets is None:
+            self._reindex()
+
+        pos = bisect.bisect_right(self._offsets, index) - 1
+        return pos, index - self._offsets[pos]
+
     def __getitem__(self, item):
         if isinstance(item, slice):
-            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
-        else:
-            return self._queue[item]
+            start, stop, step = item.indices(self._len)
+            if step != 1 or start >= stop:
+                return list(itertools.islice(self, start, stop, step))
+
+            pos, offset = self._locate(start)
+            result = []
+            for chunk in itertools.islice(self._chunks, pos, None):
+                result.extend(chunk[offset:offset + stop - start - len(result)])
+                offset = 0
+                if len(result) >= stop - start:
+                    break
+
+            return result
+
+        pos, offset = self._locate(item)
+        return self._chunks[pos][offset]
+
+    def __delitem__(self, index: int):
+        pos, offset = self._locate(index)
+        chunk = self._chunks[pos]
+        del chunk[offset]
+        self._len -= 1
+
+        if not chunk:
+            del self._chunks[pos]
+        self._offsets = None
+
+    def append(self, item):
+        if not self._chunks or len(self._chunks[-1]) >= self.CHUNK_SIZE:
+            self._chunks.append([])
+            if self._offsets is not None:
+                self._offsets.append(self._len)
+
+        self._chunks[-1].append(item)
+        self._len += 1
+
+    def extend(self, iterable):
+        for item in iterable:
+            self.append(item)
+
+    def insert(self, index: int, item):
+        if index >= self._len or not self._chunks:
+            return self.append(item)
+
+        pos, offset = self._locate(max(index, -self._len))
+        chunk = self._chunks[pos]
+        chunk.insert(offset, item)
+        self._len += 1
+
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            self._chunks[pos:pos + 1] = [chunk[:self.CHUNK_SIZE], chunk[self.CHUNK_SIZE:]]
+        self._offsets = None
+
+    def pop(self, index: int = -1):
+        item = self[index]
+        del self[index]
+        return item
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from an empty ChunkedList')
+
+        return self.pop(0)
+
+    def clear(self):
+        self._chunks.clear()
+        self._offsets = []
+        self._len = 0
+
+    def bisect_right(self, key, keyfunc):
+        """Position after the last item whose ``keyfunc`` is <= ``key``; items must be sorted."""
+
+        pos = bisect.bisect_right([keyfunc(chunk[0]) for chunk in self._chunks], key)
+        if pos == 0:
+            return 0
+
+        if self._offsets is None:
+            self._reindex()
+
+        chunk = self._chunks[pos - 1]
+        return self._offsets[pos - 1] + bisect.bisect_right([keyfunc(item) for item in chunk], key)
+
+    def rebuild(self, items: list):
+        self.clear()
+        self.extend(items)
+
+
+class SongQueue(asyncio.Queue):
+    """The song queue, with cheap indexed access and optional fair scheduling.
+
+    In fair mode every song gets a turn number: a requester's n-th pending
+    song plays in round n, so songs from different people interleave instead
+    of one big batch pushing everybody else back.
+    """
+
+    def __init__(self, *, fair: bool = False):
+        super().__init__()
+        self._fair = fair
+
+    def _init(self, maxsize: int):
+        self._queue = ChunkedList()
+        self._round = 0
+        self._last_turns = {}
+
+    def _get(self):
+        song = self._queue.popleft()
+        self._round = max(self._round, song.turn)
+        return song
+
+    def _put(self, song: 'Song'):
+        if not self._fair:
+            self._queue.append(song)
+            return
+
+        requester = song.requester.id
+        song.turn = max(self._round, self._last_turns.get(requester, 0)) + 1
+        self._last_turns[requester] = song.turn
+        self._queue.insert(self._queue.bisect_right(song.turn, self._turn), song)
+
+    @staticmethod
+    def _turn(song: 'Song'):
+        return song.turn
+
+    def __getitem__(self, item):
+        return self._queue[item]
 
     def __iter__(self):
         return self._queue.__iter__()
@@ -166,35 +1293,300 @@ class SongQueue(asyncio.Queue):
     def __len__(self):
         return self.qsize()
 
+    @property
+    def fair(self):
+        return self._fair
+
+    @fair.setter
+    def fair(self, value: bool):
+        self._fair = value
+        if value:
+            self._reschedule(list(self._queue))
+
+    def _reschedule(self, songs: list):
+        self._last_turns.clear()
+        for song in songs:
+            requester = song.requester.id
+            song.turn = self._last_turns.get(requester, self._round) + 1
+            self._last_turns[requester] = song.turn
+
+        self._queue.rebuild(sorted(songs, key=self._turn))
+
     def clear(self):
         self._queue.clear()
+        self._last_turns.clear()
 
     def shuffle(self):
-        random.shuffle(self._queue)
+        songs = list(self._queue)
+        random.shuffle(songs)
+
+        if self._fair:
+            # Turns are handed out again in the shuffled order, so requesters
+            # still alternate and a newcomer's song still lands in round one.
+            self._reschedule(songs)
+        else:
+            self._queue.rebuild(songs)
 
     def remove(self, index: int):
         del self._queue[index]
 
+    def move(self, index: int, position: int):
+        song = self._queue.pop(index)
+        position = max(0, min(position, len(self._queue)))
+        self._queue.insert(position, song)
+
+        if self._fair:
+            # Slot the song between its new neighbours so later fair inserts
+            # still find the queue sorted by turn.
+            before = self._queue[position - 1].turn if position > 0 else self._round
+            after = self._queue[position + 1].turn if position + 1 < len(self._queue) else before + 1
+            song.turn = (before + after) / 2
+
+    def page(self, page: int, per_page: int = 10):
+        start = (page - 1) * per_page
+        return self._queue[start:start + per_page]
+
+
+def report_error(bot: commands.Bot, channel: discord.abc.Messageable, error: Exception):
+    """Tells the channel a song failed; unexpected errors get their traceback logged too."""
+
+    if not isinstance(error, YTDLError):
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    bot.outbox.post(channel, 'Bir hata oluştu: {}'.format(str(error)))
+
+
+class BroadcastListener(discord.AudioSource):
+    """One guild's view of a Broadcast, reading frames from its own cursor."""
+
+    def __init__(self, broadcast: 'Broadcast', cursor: int):
+        self.broadcast = broadcast
+        self.cursor = cursor
+        self.finished = False
+
+    def read(self):
+        data = self.broadcast.frame(self)
+        if not data:
+            self.finished = True
+
+        return data
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.finished = True
+        self.broadcast.unsubscribe(self)
+
+
+class Broadcast:
+    """A radio station: one song queue and one ffmpeg, heard by many guilds.
+
+    A pump thread of its own (it's busy for the whole song, so it stays out
+    of the loop's shared executor) reads Opus frames from the current song
+    at real-time pace into a ring buffer. Every listening voice client gets a BroadcastListener
+    that starts at the live edge and keeps its own cursor into the ring; a
+    listener that falls a whole ring behind is dropped instead of holding the
+    pump back.
+    """
+
+    RING_SIZE = 250  # 5 seconds of 20 ms frames
+    SILENCE = b'\xf8\xff\xfe'
+
+    def __init__(self, bot: commands.Bot, name: str, *, on_close=None):
+        self.bot = bot
+        self.name = name
+        self.songs = SongQueue()
+        self.current = None
+        self.listeners = set()
+        self.closed = False
+
+        self._ring = [None] * self.RING_SIZE
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._skip = threading.Event()
+        self._on_close = on_close
+        self.player = bot.loop.create_task(self.player_task())
+
+    def subscribe(self):
+        with self._cond:
+            listener = BroadcastListener(self, self._seq)
+            self.listeners.add(listener)
+
+        return listener
+
+    def unsubscribe(self, listener: BroadcastListener):
+        with self._cond:
+            self.listeners.discard(listener)
+
+    def frame(self, listener: BroadcastListener):
+        with self._cond:
+            if listener not in self.listeners or self.closed:
+                return b''
+
+            if listener.cursor < self._seq - self.RING_SIZE:
+                self.listeners.discard(listener)
+                return b''
+
+            # Between songs, or if the pump hiccups, keep the voice client
+            # fed with silence rather than ending its playback.
+            if listener.cursor >= self._seq and not self._cond.wait_for(
+                    lambda: listener.cursor < self._seq or self.closed, timeout=0.1):
+                return self.SILENCE
+
+            if self.closed:
+                return b''
+
+            data = self._ring[listener.cursor % self.RING_SIZE]
+            listener.cursor += 1
+            return data
+
+    def _pump(self, source: discord.AudioSource):
+        frame_length = YTDLOpusSource.FRAME_LENGTH
+        start, frames = time.perf_counter(), 0
+
+        try:
+            while not self._skip.is_set() and not self.closed:
+                data = source.read()
+                if not data:
+                    break
+
+                with self._cond:
+                    self._ring[self._seq % self.RING_SIZE] = data
+                    self._seq += 1
+                    self._cond.notify_all()
+
+                frames += 1
+                delay = start + frames * frame_length - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -1:
+                    start, frames = time.perf_counter(), 0
+        finally:
+            source.cleanup()
+
+    def pump(self, source: discord.AudioSource):
+        """Runs ``_pump`` on a new thread; the returned future completes when the song does."""
+
+        loop = self.bot.loop
+        done = loop.create_future()
+
+        def finish(error: BaseException = None):
+            if done.done():
+                return
+            if error is None:
+                done.set_result(None)
+            else:
+                done.set_exception(error)
+
+        def run():
+            try:
+                self._pump(source)
+            except BaseException as e:
+                loop.call_soon_threadsafe(finish, e)
+            else:
+                loop.call_soon_threadsafe(finish)
+
+        threading.Thread(target=run, name='broadcast-{}'.format(self.name), daemon=True).start()
+        return done
+
+    async def player_task(self):
+        while not self.closed:
+            try:
+                async with timeout(180):
+                    self.current = await self.songs.get()
+            except asyncio.TimeoutError:
+                if not self.listeners:
+                    break
+                continue
+
+            try:
+                await self.current.resolve(loop=self.bot.loop)
+                self._skip.clear()
+                source = YTDLOpusSource(self.current, volume=1.0)
+                self.bot.outbox.post(self.current.channel, embed=self.current.create_embed(), key='now_playing')
+                await self.pump(source)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # One bad song mustn't take the station off the air.
+                report_error(self.bot, self.current.channel, e)
+            finally:
+                self.current = None
+
+        self.close()
+
+    def skip(self):
+        self._skip.set()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self.listeners.clear()
+            self._cond.notify_all()
+
+        self.songs.clear()
+        self._skip.set()
+        if self.player is not asyncio.current_task():
+            self.player.cancel()
+
+        if self._on_close is not None:
+            self._on_close(self)
+            self._on_close = None
+
 
 class VoiceState:
-    def __init__(self, bot: commands.Bot, ctx: commands.Context):
+    # How many upcoming songs get their stream URLs resolved in the background.
+    LOOKAHEAD = 3
+
+    # The next song's ffmpeg is started this many seconds before the current
+    # one ends and reads PREBUFFER_FRAMES (20 ms each) ahead.
+    PREWARM = 5
+    PREBUFFER_FRAMES = 50
+
+    def __init__(self, bot: commands.Bot, ctx: commands.Context, *, on_close=None, on_change=None):
         self.bot = bot
-        self._ctx = ctx
+        self.guild_id = ctx.guild.id
+        self.last_active = time.monotonic()
+        self._on_close = on_close
+        self._on_change = on_change
 
         self.current = None
+        self._connected = asyncio.Event()
         self.voice = None
         self.next = asyncio.Event()
         self.songs = SongQueue()
 
         self._loop = False
-        self._volume = 0.5
+        # Opus playback starts at 100%, twice as loud as the old 50% default:
+        # only at unity gain can ffmpeg copy the stream instead of decoding
+        # and re-encoding it. `!volume 50` gets the old loudness back for a
+        # guild. PCM playback keeps 50%.
+        self._volume = 1.0 if YTDLSource.PLAYBACK == 'opus' else 0.5
         self.skip_votes = set()
 
+        self._prefetch = None
+        self._prewarm = None
+        self._warm = None
+        self.broadcast = None
+        self._listener = None
         self.audio_player = bot.loop.create_task(self.audio_player_task())
 
     def __del__(self):
         self.audio_player.cancel()
 
+    @property
+    def voice(self):
+        return self._voice
+
+    @voice.setter
+    def voice(self, value: discord.VoiceClient):
+        self._voice = value
+        if value is not None:
+            self._connected.set()
+        else:
+            self._connected.clear()
+
     @property
     def loop(self):
         return self._loop
@@ -211,37 +1603,246 @@ class VoiceState:
     def volume(self, value: float):
         self._volume = value
 
+        source = self.current.source if self.current else None
+        if isinstance(source, YTDLOpusSource):
+            if self.voice and self.voice.source is source:
+                self._swap_source(source.with_volume(value))
+        elif source:
+            source.volume = value
+
+    def _swap_source(self, source: discord.AudioSource):
+        old, self.current.source = self.current.source, source
+
+        # Swapping the source resumes the player, so keep a pause in place.
+        paused = self.voice.is_paused()
+        self.voice.source = source
+        if paused:
+            self.voice.pause()
+
+        old.cleanup()
+
     @property
     def is_playing(self):
         return self.voice and self.current
 
+    @property
+    def listening(self):
+        return self._listener is not None and not self._listener.finished
+
+    @property
+    def queue(self):
+        """Where new songs go: the radio's queue while listening to one."""
+
+        return self.broadcast.songs if self.listening else self.songs
+
+    def listen(self, broadcast: Broadcast):
+        self.unlisten()
+        if self.voice.is_playing() or self.voice.is_paused():
+            self.voice.stop()
+
+        self.broadcast = broadcast
+        self._listener = broadcast.subscribe()
+        self.voice.play(self._listener, after=self.play_next_song)
+
+    def unlisten(self):
+        if self._listener is None:
+            return
+
+        listener, self._listener, self.broadcast = self._listener, None, None
+        listener.cleanup()
+        if self.voice and self.voice.source is listener:
+            self.voice.stop()
+
     async def audio_player_task(self):
         while True:
             self.next.clear()
 
-            if not self.loop:
+            if self._listener is not None:
+                # The radio owns the voice client until its listener ends.
+                await self.next.wait()
+                if self._listener is not None and self._listener.finished:
+                    self._listener = self.broadcast = None
+                continue
+
+            if not self.loop or self.current is None:
                 # Try to get the next song within 3 minutes.
                 # If no song will be added to the queue in time,
                 # the player will disconnect due to performance
                 # reasons.
                 try:
                     async with timeout(180):  # 3 minutes
+                        # A restored queue waits here until the bot is back in a channel.
+                        await self._connected.wait()
                         self.current = await self.songs.get()
                 except asyncio.TimeoutError:
-                    self.bot.loop.create_task(self.stop())
+                    if self.listening:
+                        continue
+
+                    metrics.inc('alonso_player_events_total', event='idle_disconnect')
+                    self.bot.loop.create_task(self.close())
                     return
 
-            self.current.source.volume = self._volume
-            self.voice.play(self.current.source, after=self.play_next_song)
-            await self.current.source.channel.send(embed=self.current.create_embed())
+            started = time.perf_counter()
+            try:
+                await self.current.resolve(loop=self.bot.loop)
+                self.prefetch()
+
+                self.current.source = self._take_warm(self.current)
+                # A stale wakeup (say, from stopping a radio listener) must not
+                # end this song's wait before it has even started.
+                self.next.clear()
+                self.voice.play(self.current.source, after=self.play_next_song)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # A bad song or a dropped voice client; the player moves on to the next one.
+                metrics.inc('alonso_player_events_total',
+                            event='resolve_error' if isinstance(e, YTDLError) else 'play_error')
+                report_error(self.bot, self.current.channel, e)
+                if self.current.source is not None:
+                    self.current.source.cleanup()
+                    self.current.source = None
+                self.loop = False
+                continue
+
+            self.current.start = 0.0
+            self.last_active = time.monotonic()
+            metrics.observe('alonso_player_start_seconds', time.perf_counter() - started)
+            metrics.inc('alonso_player_events_total', event='started')
+            YTDLSource.audio_cache.record_play(self.current.data, loop=self.bot.loop)
+            if YTDLSource.history is not None:
+                self.bot.loop.create_task(YTDLSource.history.record(self.guild_id, self.current.data))
+            self._schedule_prewarm()
+            self.changed()
+            self.bot.outbox.post(self.current.channel, embed=self.current.create_embed(), key='now_playing')
+
+            await self.next.wait()
+            self.current.source = None
+            if not self.loop:
+                self.current = None
+            self.changed()
+
+    def changed(self):
+        """Marks the state for the next snapshot flush."""
+
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def snapshot(self):
+        """The queue, current song and settings as plain data, or None if there's nothing to keep."""
+
+        songs = [song.snapshot() for song in self.songs]
+        if self.current is not None and self.current.source is not None:
+            position = getattr(self.current.source, 'position', 0.0)
+            songs.insert(0, self.current.snapshot(position=position))
+
+        if not songs:
+            return None
+
+        return {
+            'voice_channel': self.voice.channel.id if self.voice else None,
+            'loop': self.loop,
+            'volume': self._volume,
+            'fair': self.songs.fair,
+            'songs': songs,
+        }
+
+    async def restore(self, snapshot: dict, ctx: commands.Context):
+        """Re-queues a snapshot's songs and rejoins its voice channel."""
+
+        self._loop = snapshot.get('loop', False)
+        self._volume = snapshot.get('volume', self._volume)
+        self.songs.fair = snapshot.get('fair', False)
+        for entry in snapshot['songs']:
+            self.songs.put_nowait(Song.restore(entry, ctx))
+
+        channel = ctx.guild.get_channel(snapshot.get('voice_channel') or 0)
+        if channel is not None and self.voice is None:
+            try:
+                self.voice = await channel.connect()
+            except (discord.ClientException, asyncio.TimeoutError):
+                pass
+
+    def _schedule_prewarm(self):
+        if self._prewarm:
+            self._prewarm.cancel()
+
+        # Counted from where the source actually is: a restored song starts
+        # part-way in, and a paused one doesn't advance.
+        duration = self.current.data.get('duration')
+        if duration and self.current.source is not None:
+            remaining = duration - self.current.source.position
+            self._prewarm = self.bot.loop.create_task(self.prewarm(max(0, remaining - self.PREWARM)))
+
+    def pause(self):
+        self.voice.pause()
+        if self._prewarm:
+            self._prewarm.cancel()
+
+    def resume(self):
+        self.voice.resume()
+        if self.current is not None and self._warm is None:
+            self._schedule_prewarm()
+
+    async def prewarm(self, delay: float):
+        """Starts and pre-buffers the next song's decoder shortly before it's needed."""
+
+        await asyncio.sleep(delay)
+
+        song = self.current if self.loop else next(iter(self.songs), None)
+        if song is None:
+            return
+
+        try:
+            await song.resolve(loop=self.bot.loop)
+        except YTDLError:
+            return
+
+        source = YTDLSource.create_source(song, volume=self._volume)
+        self._discard_warm()
+        self._warm = (song, source)
+        await self.bot.loop.run_in_executor(None, source.prebuffer, self.PREBUFFER_FRAMES)
+
+    def _take_warm(self, song: 'Song'):
+        warm, self._warm = self._warm, None
+        if warm is not None:
+            warm_song, source = warm
+            if warm_song is song and source.volume == self._volume:
+                return source
+
+            source.cleanup()
+
+        return YTDLSource.create_source(song, volume=self._volume)
 
-            await self.next.wait()
+    def _discard_warm(self):
+        if self._warm is not None:
+            self._warm[1].cleanup()
+            self._warm = None
+
+    def prefetch(self):
+        """Refreshes the next few queued songs in the background."""
+
+        if self._prefetch and not self._prefetch.done():
+            return
+
+        songs = [song for song in self.songs[:self.LOOKAHEAD] if song.stale]
+        if songs:
+            self._prefetch = asyncio.gather(*(song.resolve(loop=self.bot.loop) for song in songs),
+                                            return_exceptions=True)
 
     def play_next_song(self, error=None):
+        # Called from the voice client's player thread. Raising here would
+        # only be logged there and leave the player waiting forever, so the
+        # error is reported and the player moves on either way.
         if error:
-            raise VoiceError(str(error))
+            metrics.inc('alonso_player_events_total', event='play_error')
+            song = self.current
+            if song is not None:
+                self.bot.loop.call_soon_threadsafe(report_error, self.bot, song.channel, error)
+            else:
+                traceback.print_exception(type(error), error, error.__traceback__)
 
-        self.next.set()
+        self.bot.loop.call_soon_threadsafe(self.next.set)
 
     def skip(self):
         self.skip_votes.clear()
@@ -251,28 +1852,289 @@ class VoiceState:
 
     async def stop(self):
         self.songs.clear()
+        self.unlisten()
+
+        if self._prewarm:
+            self._prewarm.cancel()
+        self._discard_warm()
 
         if self.voice:
             await self.voice.disconnect()
             self.voice = None
 
+    @property
+    def idle(self):
+        # A player task that has died will never play anything again.
+        if self.audio_player.done():
+            return True
+
+        if self.current is not None or self.listening or len(self.songs):
+            return False
+
+        return not (self.voice and (self.voice.is_playing() or self.voice.is_paused()))
+
+    @property
+    def tasks(self):
+        return [task for task in (self.audio_player, self._prefetch, self._prewarm) if task and not task.done()]
+
+    async def close(self, *, forget: bool = True):
+        """Stops playback and releases everything the state holds on to.
+
+        With ``forget`` the stored snapshot goes too; otherwise it's left for
+        the next start to restore.
+        """
+
+        if not forget:
+            self._on_change = None
+
+        for task in self.tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+
+        await self.stop()
+
+        if self.current is not None and self.current.source is not None:
+            self.current.source.cleanup()
+        self.current = None
+        self.changed()
+
+        if self._on_close is not None:
+            self._on_close(self)
+            self._on_close = None
+
+
+class VoiceStateRegistry:
+    """The guild id -> VoiceState map.
+
+    States are kept in least-recently-used order. The reaper closes states
+    that have been idle longer than ``idle_timeout``, and adding a state past
+    ``max_states`` closes the least recently used one (idle ones first), so
+    the registry can't grow without bound across thousands of guilds.
+    """
+
+    def __init__(self, bot: commands.Bot, *, max_states: int = 5000, idle_timeout: float = 5 * 60,
+                 on_change=None):
+        self.bot = bot
+        self.max_states = max_states
+        self.idle_timeout = idle_timeout
+        self.on_change = on_change
+        self._states = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, guild_id: int):
+        return guild_id in self._states
+
+    def values(self):
+        return self._states.values()
+
+    def get(self, guild_id: int):
+        state = self._states.get(guild_id)
+        if state is not None:
+            self._states.move_to_end(guild_id)
+            state.last_active = time.monotonic()
+
+        return state
+
+    def create(self, ctx: commands.Context):
+        if len(self._states) >= self.max_states:
+            self._evict_one()
+
+        state = VoiceState(self.bot, ctx, on_close=self.discard, on_change=self.on_change)
+        self._states[ctx.guild.id] = state
+        return state
+
+    def discard(self, state: VoiceState):
+        if self._states.get(state.guild_id) is state:
+            del self._states[state.guild_id]
+
+    def evict(self, guild_id: int):
+        state = self._states.pop(guild_id, None)
+        if state is not None:
+            self.bot.loop.create_task(state.close())
+
+    def _evict_one(self):
+        victim = next((guild_id for guild_id, state in self._states.items() if state.idle), None)
+        if victim is None:
+            victim = next(iter(self._states))
+
+        self.evict(victim)
+
+    def reap(self):
+        deadline = time.monotonic() - self.idle_timeout
+        expired = [guild_id for guild_id, state in self._states.items()
+                   if state.idle and state.last_active < deadline]
+        for guild_id in expired:
+            self.evict(guild_id)
+
+        return len(expired)
+
+    def stats(self):
+        return {
+            'voice_states': len(self._states),
+            'playing': sum(1 for state in self._states.values() if state.current is not None),
+            'queued_songs': sum(len(state.songs) for state in self._states.values()),
+            'max_queue': max((len(state.songs) for state in self._states.values()), default=0),
+            'state_tasks': sum(len(state.tasks) for state in self._states.values()),
+            'loop_tasks': len(asyncio.all_tasks(self.bot.loop)),
+            'ffmpeg_processes': BufferedAudio.running(),
+            'cache_downloads': len(YTDLSource.audio_cache._pending),
+        }
+
 
 class Music(commands.Cog):
+    # Most songs one !play can queue, and how often its status message is edited.
+    BULK_LIMIT = 25
+    BULK_EDIT_INTERVAL = 1.5
+    # !stats that are a per-process peak, so shards report their max instead of a sum.
+    PEAK_STATS = ('latency_ms', 'max_queue')
+    # Pause between guilds when rejoining voice after a restart.
+    RESTORE_INTERVAL = 0.5
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.voice_states = {}
-
-    def get_voice_state(self, ctx: commands.Context):
+        self.store = getattr(bot, 'store', None)
+        self.voice_states = VoiceStateRegistry(bot, on_change=self.store.mark if self.store else None)
+        self.broadcasts = {}
+        self._restoring = None
+        self.reaper.start()
+        if self.store is not None:
+            self.snapshotter.start()
+            YTDLSource.history = PlayHistory(self.store)
+
+        if getattr(bot, 'ipc', None) is not None:
+            bot.ipc.handlers['stats'] = self.shard_stats
+        metrics.collectors.append(self.gauges)
+
+    async def get_voice_state(self, ctx: commands.Context):
         state = self.voice_states.get(ctx.guild.id)
         if not state:
-            state = VoiceState(self.bot, ctx)
-            self.voice_states[ctx.guild.id] = state
+            state = self.voice_states.create(ctx)
+
+            # Picks up where the guild left off before a restart.
+            snapshot = await self._load_snapshot(ctx.guild.id)
+            if snapshot:
+                await state.restore(snapshot, ctx)
 
         return state
 
+    def restore_stored(self):
+        """Starts bringing back every stored guild's queue in the background, once per process."""
+
+        if self.store is not None and self._restoring is None:
+            self._restoring = self.bot.loop.create_task(self._restore_stored())
+
+        return self._restoring
+
+    def _owns(self, guild_id: int):
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        if not shard_ids:
+            return True
+
+        return (guild_id >> 22) % self.bot.shard_count in shard_ids
+
+    async def _restore_stored(self):
+        try:
+            guild_ids = await self.bot.loop.run_in_executor(None, self.store.guild_ids)
+        except sqlite3.Error as e:
+            print('Could not list queue snapshots: {}'.format(e))
+            return
+
+        gone = []
+        for guild_id in guild_ids:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                # Left while we were down; guilds of other shard processes are theirs to restore.
+                if self._owns(guild_id):
+                    gone.append(guild_id)
+                continue
+
+            # A command got there first and restored it already.
+            if self.voice_states.get(guild_id) is not None:
+                continue
+
+            try:
+                await self._restore_guild(guild)
+            except Exception as e:
+                print('Could not restore the queue of {}: {}'.format(guild_id, e))
+
+            await asyncio.sleep(self.RESTORE_INTERVAL)
+
+        if gone:
+            try:
+                await self.bot.loop.run_in_executor(None, self.store.forget, gone)
+            except sqlite3.Error as e:
+                print('Could not drop queue snapshots: {}'.format(e))
+
+    async def _restore_guild(self, guild: discord.Guild):
+        # What Song.restore falls back to when the requester or channel is gone.
+        ctx = types.SimpleNamespace(guild=guild, author=guild.me,
+                                    channel=guild.system_channel or next(iter(guild.text_channels), None))
+        state = self.voice_states.create(ctx)
+        snapshot = await self._load_snapshot(guild.id)
+        if snapshot:
+            await state.restore(snapshot, ctx)
+
+        if state.voice is None:
+            # Nowhere to play. The snapshot is dropped if its channel is gone,
+            # and kept for the next command if joining just failed.
+            channel = guild.get_channel((snapshot or {}).get('voice_channel') or 0)
+            await state.close(forget=channel is None)
+
+    async def _load_snapshot(self, guild_id: int):
+        if self.store is None:
+            return None
+
+        # Off the loop: writers hold the store's lock, and other shard
+        # processes can keep SQLite busy for a while.
+        try:
+            return await self.bot.loop.run_in_executor(None, self.store.load, guild_id)
+        except sqlite3.Error as e:
+            print('Could not load the queue snapshot: {}'.format(e))
+            return None
+
+    @tasks.loop(seconds=60)
+    async def reaper(self):
+        self.voice_states.reap()
+
+    @tasks.loop(seconds=5)
+    async def snapshotter(self):
+        try:
+            await self.store.flush(loop=self.bot.loop)
+        except sqlite3.Error as e:
+            print('Queue snapshot failed: {}'.format(e))
+
+    async def shard_stats(self):
+        stats = self.voice_states.stats()
+        stats['radios'] = len(self.broadcasts)
+        stats['guilds'] = len(self.bot.guilds)
+        stats['shards'] = len(self.bot.latencies)
+        stats['latency_ms'] = round(self.bot.latency * 1000)
+        return stats
+
+    def gauges(self):
+        stats = self.voice_states.stats()
+        stats['radios'] = len(self.broadcasts)
+        return {'alonso_' + key: value for key, value in stats.items()}
+
     def cog_unload(self):
-        for state in self.voice_states.values():
-            self.bot.loop.create_task(state.stop())
+        self.reaper.cancel()
+        metrics.collectors.remove(self.gauges)
+
+        # Keep the queues for whoever loads the cog next.
+        if self.store is not None:
+            self.snapshotter.cancel()
+            self.store.sync()
+
+        for state in list(self.voice_states.values()):
+            self.bot.loop.create_task(state.close(forget=False))
+
+        for broadcast in list(self.broadcasts.values()):
+            broadcast.close()
+
+        YTDLSource.engine.close()
+        YTDLSource.audio_cache.close()
 
     def cog_check(self, ctx: commands.Context):
         if not ctx.guild:
@@ -281,7 +2143,10 @@ class Music(commands.Cog):
         return True
 
     async def cog_before_invoke(self, ctx: commands.Context):
-        ctx.voice_state = self.get_voice_state(ctx)
+        ctx.voice_state = await self.get_voice_state(ctx)
+
+    async def cog_after_invoke(self, ctx: commands.Context):
+        ctx.voice_state.changed()
 
     async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
         await ctx.send('Mierda! bi şey oldu: {}'.format(str(error)))
@@ -323,8 +2188,7 @@ class Music(commands.Cog):
         if not ctx.voice_state.voice:
             return await ctx.send('Hiçbi kanalda değilim zaten smh')
 
-        await ctx.voice_state.stop()
-        del self.voice_states[ctx.guild.id]
+        await ctx.voice_state.close()
 
     @commands.command(name='volume')
     async def _volume(self, ctx: commands.Context, *, volume: int):
@@ -339,10 +2203,48 @@ class Music(commands.Cog):
         ctx.voice_state.volume = volume / 100
         await ctx.send('Tamamdır bu değere ayarladım {}%'.format(volume))
 
+    @commands.command(name='stats')
+    async def _stats(self, ctx: commands.Context):
+        """Botun o anki ses durumlarını, görevlerini ve ffmpeg sayısını (tüm shardlar için) gösterir"""
+
+        stats = await self.shard_stats()
+        ipc = getattr(self.bot, 'ipc', None)
+        if ipc is not None:
+            try:
+                results = await ipc.call('stats')
+            except (ConnectionError, asyncio.TimeoutError):
+                pass
+            else:
+                answered = [result for result in results if result and 'error' not in result]
+                for key in stats:
+                    values = [result.get(key, 0) for result in answered]
+                    stats[key] = max(values, default=0) if key in self.PEAK_STATS else sum(values)
+                stats['processes'] = '{}/{}'.format(len(answered), len(results))
+
+        await ctx.send('```\n{}\n```'.format('\n'.join('{}: {}'.format(k, v) for k, v in stats.items())))
+
+    @commands.command(name='history', aliases=['geçmiş', 'gecmis'])
+    async def _history(self, ctx: commands.Context, *, search: str):
+        """Daha önce çalınan şarkılar arasında arar"""
+
+        if YTDLSource.history is None:
+            return await ctx.send('Geçmiş kapalı')
+
+        matches = await YTDLSource.history.suggest(ctx.guild.id, search, loop=self.bot.loop)
+        if not matches:
+            return await ctx.send('Geçmişte böyle bir şey yok')
+
+        lines = ('`{}.` [**{}**]({}) {} · {} kez'.format(i, title, url, uploader, plays)
+                 for i, (url, title, uploader, plays) in enumerate(matches, start=1))
+        await ctx.send(embed=discord.Embed(description='\n'.join(lines), color=discord.Color.blurple()))
+
     @commands.command(name='now', aliases=['current', 'playing'])
     async def _now(self, ctx: commands.Context):
         """Şu anda oynatılan şarkıyı gösterir"""
 
+        if ctx.voice_state.current is None:
+            return await ctx.send('Bi şey oynamıyo şu an')
+
         await ctx.send(embed=ctx.voice_state.current.create_embed())
 
     @commands.command(name='pause')
@@ -351,7 +2253,7 @@ class Music(commands.Cog):
         """Şarkıyı pause eder"""
 
         if not ctx.voice_state.is_playing and ctx.voice_state.voice.is_playing():
-            ctx.voice_state.voice.pause()
+            ctx.voice_state.pause()
             await ctx.message.add_reaction('⏯')
 
     @commands.command(name='resume')
@@ -360,7 +2262,7 @@ class Music(commands.Cog):
         """Pause edilen şarkıyı devam ettirir"""
 
         if not ctx.voice_state.is_playing and ctx.voice_state.voice.is_paused():
-            ctx.voice_state.voice.resume()
+            ctx.voice_state.resume()
             await ctx.message.add_reaction('⏯')
 
     @commands.command(name='stop')
@@ -400,7 +2302,7 @@ class Music(commands.Cog):
                 await ctx.message.add_reaction('⏭')
                 ctx.voice_state.skip()
             else:
-                await ctx.send('Skip oylaması başladı **{}/3**'.format(total_votes))
+                await self.bot.outbox.send(ctx.channel, 'Skip oylaması başladı **{}/3**'.format(total_votes), key='skip_votes')
 
         else:
             await ctx.send('Sen zaten oy verdin')
@@ -419,11 +2321,8 @@ class Music(commands.Cog):
         pages = math.ceil(len(ctx.voice_state.songs) / items_per_page)
 
         start = (page - 1) * items_per_page
-        end = start + items_per_page
-
-        queue = ''
-        for i, song in enumerate(ctx.voice_state.songs[start:end], start=start):
-            queue += '`{0}.` [**{1.source.title}**]({1.source.url})\n'.format(i + 1, song)
+        queue = ''.join('`{0}.` [**{1.title}**]({1.url})\n'.format(i, song)
+                        for i, song in enumerate(ctx.voice_state.songs.page(page, items_per_page), start=start + 1))
 
         embed = (discord.Embed(description='**{} Sıradaki şarkılar:**\n\n{}'.format(len(ctx.voice_state.songs), queue))
                  .set_footer(text='Gösterilen sayfa {}/{}'.format(page, pages)))
@@ -449,6 +2348,24 @@ class Music(commands.Cog):
         ctx.voice_state.songs.remove(index - 1)
         await ctx.message.add_reaction('✅')
 
+    @commands.command(name='move')
+    async def _move(self, ctx: commands.Context, index: int, position: int):
+        """Sıradaki bir şarkıyı başka bir sıraya taşır"""
+
+        if len(ctx.voice_state.songs) == 0:
+            return await ctx.send('Boş queue.')
+
+        ctx.voice_state.songs.move(index - 1, position - 1)
+        await ctx.message.add_reaction('✅')
+
+    @commands.command(name='fair')
+    async def _fair(self, ctx: commands.Context):
+        """Sırayı isteyen kişiler arasında sırayla döndürür. Tekrar yazınca kapanır
+        """
+
+        ctx.voice_state.songs.fair = not ctx.voice_state.songs.fair
+        await ctx.message.add_reaction('✅')
+
     @commands.command(name='loop')
     async def _loop(self, ctx: commands.Context):
         """Çalan şarkıyı loop'a sokar
@@ -463,22 +2380,133 @@ class Music(commands.Cog):
 
     @commands.command(name='play')
     async def _play(self, ctx: commands.Context, *, search: str):
-        """Bir şarkı çalar
+        """Bir şarkı çalar. Playlist linki verilirse bütün listeyi sıraya ekler.
+        Birden fazla şarkı için her birini ayrı satıra yaz ya da ; ile ayır
         """
 
         if not ctx.voice_state.voice:
             await ctx.invoke(self._join)
 
+        queries = [query.strip() for query in re.split(r'[\n;]', search) if query.strip()]
+        if len(queries) > 1:
+            return await self._play_many(ctx, queries)
+
+        if YTDLSource.is_playlist(search):
+            return await self._play_playlist(ctx, search)
+
         async with ctx.typing():
             try:
-                source = await YTDLSource.create_source(ctx, search, loop=self.bot.loop)
+                song = await Song.from_search(ctx, search, loop=self.bot.loop)
             except YTDLError as e:
                 await ctx.send('Bir hata oluştu: {}'.format(str(e)))
             else:
-                song = Song(source)
+                await ctx.voice_state.queue.put(song)
+                await self.bot.outbox.send(ctx.channel, 'Sıraya alındı {}'.format(str(song)))
+
+    async def _play_many(self, ctx: commands.Context, queries: list):
+        """Resolves several searches at once and queues them in the order given.
+
+        All lookups start together; the extraction engine's per-guild limit
+        bounds how many actually run in parallel. Playlist links are expanded
+        flat, the same as a lone ``!play`` of one. Progress goes into a single
+        status message, edited at most every ``BULK_EDIT_INTERVAL`` seconds.
+        """
+
+        note = ''
+        if len(queries) > self.BULK_LIMIT:
+            note = '\nTek seferde en fazla {} şarkı, gerisini atladım'.format(self.BULK_LIMIT)
+            queries = queries[:self.BULK_LIMIT]
+
+        status = await ctx.send('**{}** şarkı aranıyor...{}'.format(len(queries), note))
+        lookups = [self.bot.loop.create_task(self._lookup(ctx, query)) for query in queries]
+
+        queued, missing = 0, []
+        last_edit = time.monotonic()
+        try:
+            for done, (query, lookup) in enumerate(zip(queries, lookups), start=1):
+                try:
+                    songs = await lookup
+                except YTDLError:
+                    missing.append(query)
+                else:
+                    for song in songs:
+                        await ctx.voice_state.queue.put(song)
+                    queued += len(songs)
+
+                if done < len(queries) and time.monotonic() - last_edit >= self.BULK_EDIT_INTERVAL:
+                    last_edit = time.monotonic()
+                    await status.edit(content='Sıraya alınıyor... **{}/{}**{}'.format(done, len(queries), note))
+        finally:
+            for lookup in lookups:
+                lookup.cancel()
+
+        content = 'Sıraya alındı **{}** şarkı{}'.format(queued, note)
+        if missing:
+            content += '\nBulamadıklarım: {}'.format(', '.join('`{}`'.format(query) for query in missing))
+        await status.edit(content=content)
+
+    async def _lookup(self, ctx: commands.Context, query: str):
+        if YTDLSource.is_playlist(query):
+            _, entries, _ = await YTDLSource.extract_playlist(query, guild_id=ctx.guild.id, loop=self.bot.loop)
+            return list(Song.placeholders(ctx, entries))
+
+        return [await Song.from_search(ctx, query, loop=self.bot.loop)]
+
+    async def _play_playlist(self, ctx: commands.Context, url: str):
+        async with ctx.typing():
+            try:
+                title, entries, truncated = await YTDLSource.extract_playlist(url, guild_id=ctx.guild.id,
+                                                                              loop=self.bot.loop)
+            except YTDLError as e:
+                await ctx.send('Bir hata oluştu: {}'.format(str(e)))
+                return
+
+            for song in Song.placeholders(ctx, entries):
+                ctx.voice_state.queue.put_nowait(song)
+
+            note = ''
+            if truncated:
+                note = '\nTek seferde en fazla {} şarkı, gerisini atladım'.format(YTDLSource.PLAYLIST_LIMIT)
+            await ctx.send('Sıraya alındı **{}** şarkı: **{}**{}'.format(len(entries), title, note))
+
+    @commands.group(name='radio', invoke_without_command=True)
+    async def _radio(self, ctx: commands.Context, *, name: str):
+        """Ortak bir radyoya bağlanır. Aynı radyoyu dinleyen bütün sunucular aynı şarkıyı duyar.
+        Bağlıyken !play ile eklenen şarkılar radyonun sırasına gider
+        """
+
+        await self.ensure_voice_state(ctx)
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self._join)
+
+        broadcast = self.broadcasts.get(name)
+        if broadcast is None:
+            broadcast = Broadcast(self.bot, name, on_close=lambda b: self.broadcasts.pop(b.name, None))
+            self.broadcasts[name] = broadcast
+
+        ctx.voice_state.listen(broadcast)
+        await ctx.send('**{}** radyosuna bağlandım, {} sunucu dinliyor'.format(name, len(broadcast.listeners)))
+
+    @_radio.command(name='leave')
+    async def _radio_leave(self, ctx: commands.Context):
+        """Radyodan çıkıp sunucunun kendi sırasına döner"""
+
+        if not ctx.voice_state.listening:
+            return await ctx.send('Radyo dinlemiyorum ki')
 
-                await ctx.voice_state.songs.put(song)
-                await ctx.send('Sıraya alındı {}'.format(str(source)))
+        ctx.voice_state.unlisten()
+        await ctx.message.add_reaction('✅')
+
+    @_radio.command(name='skip')
+    @commands.has_permissions(manage_guild=True)
+    async def _radio_skip(self, ctx: commands.Context):
+        """Radyoda çalan şarkıyı bütün sunucular için geçer"""
+
+        if not ctx.voice_state.listening:
+            return await ctx.send('Radyo dinlemiyorum ki')
+
+        ctx.voice_state.broadcast.skip()
+        await ctx.message.add_reaction('⏭')
 
     @_join.before_invoke
     @_play.before_invoke
@@ -491,10 +2519,1009 @@ class Music(commands.Cog):
                 raise commands.CommandError('Zaten VCdeyim.')
 
 
-bot = commands.Bot(command_prefix=commands.when_mentioned_or("!"),
-                   description='ha pu bottur')
+class Outgoing:
+    """A message waiting in an Outbox, and everyone waiting for it to go out."""
+
+    __slots__ = ('content', 'embed', 'file', 'key', 'waiters')
+
+    def __init__(self, content: str, embed: discord.Embed, file: discord.File, key: str, waiter: asyncio.Future):
+        self.content = content
+        self.embed = embed
+        self.file = file
+        self.key = key
+        self.waiters = [waiter]
+
+    def absorb(self, other: 'Outgoing'):
+        """Appends ``other`` to this message if the result still reads in the same order."""
+
+        if self.key or other.key or self.embed or self.file:
+            return False
+
+        content = '\n'.join(part for part in (self.content, other.content) if part)
+        if len(content) > Outbox.MAX_LENGTH:
+            return False
+
+        self.content, self.embed, self.file = content or None, other.embed, other.file
+        self.waiters.extend(other.waiters)
+        return True
+
+
+class OutboxChannel:
+    """One channel's queue, rate-limit bucket and last status messages.
+
+    ``last_id`` is the bot's own latest message there, from its sends and
+    from ``Outbox.observe``.
+    """
+
+    __slots__ = ('channel', 'pending', 'worker', 'tokens', 'updated', 'keyed', 'last_id')
+
+    def __init__(self, channel: discord.abc.Messageable, tokens: float):
+        self.channel = channel
+        self.pending = collections.deque()
+        self.worker = None
+        self.tokens = tokens
+        self.updated = time.monotonic()
+        self.keyed = {}
+        self.last_id = None
+
+
+class Outbox:
+    """Per-channel outbound message queue that keeps under Discord's rate limits.
+
+    Each channel gets a worker that drains its queue, paced by a token bucket
+    matching Discord's per-channel limit (``BURST`` messages, then ``RATE``
+    per second). Before sending, plain text messages absorb whatever was
+    queued right behind them. Messages sent with a ``key`` are status
+    messages: a newer one replaces one still in the queue, and once sent, it
+    edits the previous one with the same key if the bot hasn't said anything
+    else in the channel since (other people's messages don't count, so a vote
+    count still updates under each ``!skip``).
+    """
+
+    BURST = 5
+    RATE = 1.0
+    MAX_LENGTH = 2000
+    MAX_CHANNELS = 10000
+
+    def __init__(self):
+        self._channels = collections.OrderedDict()
+
+    def _box(self, channel: discord.abc.Messageable):
+        box = self._channels.get(channel.id)
+        if box is None:
+            box = self._channels[channel.id] = OutboxChannel(channel, float(self.BURST))
+            while len(self._channels) > self.MAX_CHANNELS:
+                self._channels.popitem(last=False)
+
+        self._channels.move_to_end(channel.id)
+        return box
+
+    def post(self, channel: discord.abc.Messageable, content: str = None, *, embed: discord.Embed = None,
+             file: discord.File = None, key: str = None):
+        """Queues a message without waiting; returns a future for the sent Message."""
+
+        if isinstance(channel, commands.Context):
+            channel = channel.channel
+
+        box = self._box(channel)
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        # Nobody has to await it; don't log errors for fire-and-forget posts.
+        waiter.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+        superseded = None
+        if key is not None:
+            superseded = next((item for item in box.pending if item.key == key), None)
+
+        if superseded is not None:
+            superseded.content, superseded.embed, superseded.file = content, embed, file
+            superseded.waiters.append(waiter)
+            metrics.inc('alonso_outbox_total', result='replaced')
+        else:
+            box.pending.append(Outgoing(content, embed, file, key, waiter))
+
+        if box.worker is None or box.worker.done():
+            box.worker = loop.create_task(self._drain(box))
+
+        return waiter
+
+    async def send(self, channel: discord.abc.Messageable, content: str = None, **fields):
+        return await self.post(channel, content, **fields)
+
+    def observe(self, message: discord.Message):
+        """Notes a message the bot sent without the outbox, so keyed edits don't jump over it."""
+
+        box = self._channels.get(message.channel.id)
+        if box is not None:
+            box.last_id = max(box.last_id or 0, message.id)
+
+    async def _take_token(self, box: OutboxChannel):
+        now = time.monotonic()
+        box.tokens = min(self.BURST, box.tokens + (now - box.updated) * self.RATE)
+        box.updated = now
+        if box.tokens < 1:
+            await asyncio.sleep((1 - box.tokens) / self.RATE)
+            box.tokens, box.updated = 1.0, time.monotonic()
+
+        box.tokens -= 1
+
+    async def _drain(self, box: OutboxChannel):
+        pending = box.pending
+        while pending:
+            await self._take_token(box)
+
+            # Whatever piled up while waiting for the token can ride along.
+            item = pending.popleft()
+            while pending and item.absorb(pending[0]):
+                pending.popleft()
+                metrics.inc('alonso_outbox_total', result='merged')
+
+            try:
+                message = await self._deliver(box, item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Whatever went wrong belongs to this message's senders; the
+                # rest of the queue still goes out.
+                for waiter in item.waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+            else:
+                for waiter in item.waiters:
+                    if not waiter.done():
+                        waiter.set_result(message)
+
+    async def _deliver(self, box: OutboxChannel, item: Outgoing):
+        channel = box.channel
+        if item.key is not None and item.file is None:
+            previous = box.keyed.get(item.key)
+            if previous is not None and previous.id == box.last_id:
+                try:
+                    await previous.edit(content=item.content, embed=item.embed)
+                except discord.NotFound:
+                    # Somebody deleted it; post a fresh one instead.
+                    del box.keyed[item.key]
+                else:
+                    metrics.inc('alonso_outbox_total', result='edited')
+                    return previous
+
+        message = await channel.send(item.content, embed=item.embed, file=item.file)
+        metrics.inc('alonso_outbox_total', result='sent')
+        box.last_id = max(box.last_id or 0, message.id)
+        if item.key is not None:
+            box.keyed[item.key] = message
+
+        return message
+
+
+class AssetStore:
+    """The image files the bot sends, read once and uploaded once.
+
+    Files are loaded into memory up front so missing ones show up at startup
+    instead of as a failed command. After the first upload the attachment's
+    CDN URL is remembered, and later sends embed that URL instead of
+    uploading the bytes again. URLs are refreshed after ``url_ttl`` seconds
+    because Discord's attachment links eventually expire.
+    """
+
+    def __init__(self, directory: str = '.', *, url_ttl: float = 12 * 60 * 60, outbox: Outbox = None):
+        self.directory = directory
+        self.url_ttl = url_ttl
+        self.outbox = outbox
+        self.missing = set()
+
+        self._data = {}
+        self._urls = {}
+
+    def load(self, names: list):
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    self._data[name] = f.read()
+            except FileNotFoundError:
+                self.missing.add(name)
+                print('Asset not found: {}'.format(name))
+
+    def __contains__(self, name: str):
+        return name in self._data
+
+    def available(self, names: list):
+        return [name for name in names if name in self._data]
+
+    async def send(self, channel: discord.abc.Messageable, name: str, *, content: str = None):
+        send = functools.partial(self.outbox.send, channel) if self.outbox else channel.send
+
+        cached = self._urls.get(name)
+        if cached is not None and time.monotonic() - cached[1] < self.url_ttl:
+            return await send(content, embed=discord.Embed().set_image(url=cached[0]))
+
+        if name not in self._data and name not in self.missing:
+            self.load([name])
+        if name not in self._data:
+            return None
+
+        message = await send(content, file=discord.File(io.BytesIO(self._data[name]), filename=name))
+        if message.attachments:
+            self._urls[name] = (message.attachments[0].url, time.monotonic())
+
+        return message
+
+
+class WebClient:
+    """One pooled aiohttp session for the bot's whole lifetime.
+
+    Connections and DNS lookups are reused between calls, and every request
+    is bounded by ``timeout`` so a slow upstream can't hang a command.
+    """
+
+    def __init__(self, *, timeout: float = 5.0, connect_timeout: float = 2.0, connections: int = 20,
+                 dns_ttl: int = 300):
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.connections = connections
+        self.dns_ttl = dns_ttl
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections, ttl_dns_cache=self.dns_ttl),
+                timeout=self.timeout)
+
+        return self._session
+
+    async def get_json(self, url: str):
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class MediaEndpoint:
+    """A "send a random picture from this API" command.
+
+    A few responses are fetched ahead of time and kept in a buffer that is
+    topped up in the background, so most invocations answer from memory.
+    ``key`` picks the URL out of the JSON response.
+    """
+
+    def __init__(self, web: WebClient, url: str, *, key: str = 'link', buffer: int = 5):
+        self.web = web
+        self.url = url
+        self.key = key
+        self.size = buffer
+
+        self._buffer = collections.deque()
+        self._refill = None
+
+    async def _fetch(self):
+        data = await self.web.get_json(self.url)
+        if self.key and isinstance(data, dict) and self.key in data:
+            return data[self.key]
+
+        return data
+
+    async def _fill(self):
+        while len(self._buffer) < self.size:
+            try:
+                self._buffer.append(await self._fetch())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                # Try again on the next invocation rather than hammering a
+                # struggling upstream.
+                return
+
+    def refill(self):
+        if (self._refill is None or self._refill.done()) and len(self._buffer) < self.size:
+            self._refill = asyncio.ensure_future(self._fill())
+
+    async def get(self):
+        try:
+            if self._buffer:
+                return self._buffer.popleft()
+
+            return await self._fetch()
+        finally:
+            self.refill()
+
+    def command(self, name: str, *, help: str = None):
+        async def callback(ctx: commands.Context):
+            try:
+                item = await self.get()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                await ctx.send('Bir sey yanlis gitti')
+            else:
+                await ctx.send(item)
+
+        return commands.Command(callback, name=name, help=help)
+
+
+class LoopWatchdog:
+    """Opt-in detector for code that blocks the event loop.
+
+    A heartbeat task stamps the time every ``interval`` seconds. A sampler
+    thread watches the stamp; once the loop has been silent for longer than
+    ``threshold`` it samples the loop thread's stack every
+    ``sample_interval`` until the loop comes back, then prints how long the
+    stall lasted and where the loop was caught most often. ``hotspots`` adds
+    up the blocked seconds per call site across stalls.
+    """
+
+    def __init__(self, threshold: float = 0.25, *, interval: float = 0.05, sample_interval: float = 0.01,
+                 depth: int = 4, top: int = 3):
+        self.threshold = threshold
+        self.interval = min(interval, threshold / 2)
+        self.sample_interval = sample_interval
+        self.depth = depth
+        self.top = top
+        self.hotspots = collections.Counter()
+
+        self._beat = time.monotonic()
+        self._thread_id = None
+        self._heartbeat = None
+        self._stopped = threading.Event()
+
+    def start(self, loop: asyncio.BaseEventLoop = None):
+        """Starts watching; call it from the loop's own thread."""
+
+        loop = loop or asyncio.get_event_loop()
+        self._thread_id = threading.get_ident()
+        self._heartbeat = loop.create_task(self._beat_task())
+        threading.Thread(target=self._sample, name='loop-watchdog', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+
+    async def _beat_task(self):
+        while True:
+            start = self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            metrics.observe('alonso_loop_lag_seconds', time.monotonic() - start - self.interval)
+
+    def _site(self, frame):
+        stack = traceback.StackSummary.extract(traceback.walk_stack(frame), limit=self.depth, lookup_lines=False)
+        return ' <- '.join('{}:{} in {}'.format(os.path.basename(entry.filename), entry.lineno, entry.name)
+                           for entry in stack)
+
+    def _sample(self):
+        while not self._stopped.wait(self.sample_interval):
+            stalled_since = self._beat
+            if time.monotonic() - stalled_since < self.threshold:
+                continue
+
+            samples = collections.Counter()
+            while self._beat == stalled_since and not self._stopped.is_set():
+                frame = sys._current_frames().get(self._thread_id)
+                if frame is not None:
+                    samples[self._site(frame)] += 1
+                del frame
+                time.sleep(self.sample_interval)
+
+            self._report(self._beat - stalled_since - self.interval, samples)
+
+    def _report(self, duration: float, samples: collections.Counter):
+        metrics.inc('alonso_loop_stalls_total')
+        metrics.observe('alonso_loop_stall_seconds', duration)
+
+        total = sum(samples.values()) or 1
+        lines = ['Event loop blocked for {:.0f}ms:'.format(duration * 1000)]
+        for site, count in samples.most_common(self.top):
+            blocked = duration * count / total
+            self.hotspots[site] += blocked
+            lines.append('  {:6.0f}ms  {}'.format(blocked * 1000, site))
+
+        print('\n'.join(lines))
+
+
+class StateStore:
+    """The bot's SQLite database: voice state snapshots and play history.
+
+    VoiceStates are marked dirty as they change, and ``flush`` encodes and
+    writes just those, in one transaction on a worker thread. Songs are
+    stored as their trimmed info dicts (minus ``DROPPED_FIELDS``), so
+    restoring a queue needs no extraction. Every
+    played track is kept in ``tracks`` with per-guild counts in ``plays``;
+    PlayHistory indexes them.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS voice_states (
+            guild_id INTEGER PRIMARY KEY,
+            snapshot TEXT NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tracks (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL UNIQUE,
+            title TEXT,
+            uploader TEXT,
+            tags TEXT
+        );
+        CREATE TABLE IF NOT EXISTS plays (
+            guild_id INTEGER NOT NULL,
+            track_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            last_played REAL NOT NULL,
+            PRIMARY KEY (guild_id, track_id)
+        );
+    '''
+
+    # Big and never shown for a queued song.
+    DROPPED_FIELDS = ('description',)
+
+    def __init__(self, path: str = 'alonso.db'):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+        self._dirty = {}
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            # Shard processes share the file; WAL lets readers and a writer overlap.
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(self.SCHEMA)
+
+        return self._db
+
+    def mark(self, state: 'VoiceState'):
+        self._dirty[state.guild_id] = state
+
+    def load(self, guild_id: int):
+        with self._lock:
+            row = self.db.execute('SELECT snapshot FROM voice_states WHERE guild_id = ?', (guild_id,)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def _collect(self):
+        dirty, self._dirty = self._dirty, {}
+        now = time.time()
+        return [(guild_id, state.snapshot(), now) for guild_id, state in dirty.items()]
+
+    @classmethod
+    def _encode(cls, snapshot: dict):
+        # Info dicts are replaced, never mutated, so they're safe to read off the loop.
+        for entry in snapshot['songs']:
+            entry['data'] = {key: value for key, value in entry['data'].items() if key not in cls.DROPPED_FIELDS}
+
+        return json.dumps(snapshot, separators=(',', ':'))
+
+    def _write(self, rows: list):
+        rows = [(guild_id, self._encode(snapshot) if snapshot else None, now) for guild_id, snapshot, now in rows]
+        with metrics.timer('alonso_snapshot_flush_seconds'), self._lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO voice_states VALUES (?, ?, ?)',
+                                [row for row in rows if row[1] is not None])
+            self.db.executemany('DELETE FROM voice_states WHERE guild_id = ?',
+                                [(row[0],) for row in rows if row[1] is None])
+
+    async def flush(self, *, loop: asyncio.BaseEventLoop = None):
+        if not self._dirty:
+            return 0
+
+        rows = self._collect()
+        loop = loop or asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._write, rows)
+        return len(rows)
+
+    def add_play(self, guild_id: int, url: str, title: str, uploader: str, tags: str):
+        """Counts a play; returns the track's id and whether it's new."""
+
+        with self._lock, self.db:
+            created = self.db.execute('INSERT OR IGNORE INTO tracks (url, title, uploader, tags) VALUES (?, ?, ?, ?)',
+                                      (url, title, uploader, tags)).rowcount == 1
+            track_id = self.db.execute('SELECT id FROM tracks WHERE url = ?', (url,)).fetchone()[0]
+            self.db.execute('INSERT OR IGNORE INTO plays VALUES (?, ?, 0, 0)', (guild_id, track_id))
+            self.db.execute('UPDATE plays SET count = count + 1, last_played = ? WHERE guild_id = ? AND track_id = ?',
+                            (time.time(), guild_id, track_id))
+
+        return track_id, created
+
+    def tracks(self, *, batch: int = 5000):
+        """Yields (id, title, uploader, tags) for every track, a page at a time."""
+
+        last = 0
+        while True:
+            with self._lock:
+                rows = self.db.execute('SELECT id, title, uploader, tags FROM tracks WHERE id > ? ORDER BY id LIMIT ?',
+                                       (last, batch)).fetchall()
+            if not rows:
+                return
+
+            yield from rows
+            last = rows[-1][0]
+
+    def track_info(self, track_ids: list):
+        """Maps track ids to (url, title, uploader)."""
+
+        with self._lock:
+            rows = self.db.execute('SELECT id, url, title, uploader FROM tracks WHERE id IN ({})'.format(
+                ','.join('?' * len(track_ids))), list(track_ids)).fetchall()
+
+        return {row[0]: row[1:] for row in rows}
+
+    def guild_plays(self, guild_id: int):
+        with self._lock:
+            return dict(self.db.execute('SELECT track_id, count FROM plays WHERE guild_id = ?', (guild_id,)))
+
+    def guild_ids(self):
+        """Guilds with a stored snapshot, most recently updated first."""
+
+        with self._lock:
+            return [row[0] for row in self.db.execute('SELECT guild_id FROM voice_states ORDER BY updated DESC')]
+
+    def forget(self, guild_ids: list):
+        with self._lock, self.db:
+            self.db.executemany('DELETE FROM voice_states WHERE guild_id = ?', [(guild_id,) for guild_id in guild_ids])
+
+    def sync(self):
+        """Flushes on the calling thread, for shutdown."""
+
+        if self._dirty:
+            self._write(self._collect())
+
+    def close(self):
+        self.sync()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class ShardLink:
+    """A shard process's line to the ShardLauncher.
+
+    ``call`` asks every shard process (this one included) to run the named
+    handler and returns their results in process order; a process that
+    doesn't answer in time shows up as ``None``. Messages are JSON, one per
+    line, over a localhost socket.
+    """
+
+    def __init__(self, address: str, process: int, *, timeout: float = 5.0):
+        self.address = address
+        self.process = process
+        self.timeout = timeout
+        self.handlers = {}
+
+        self._ids = itertools.count()
+        self._pending = {}
+        self._writer = None
+        self._reader = None
+
+    @classmethod
+    def from_env(cls):
+        address = os.environ.get('ALONSO_IPC')
+        if not address:
+            return None
+
+        return cls(address, int(os.environ.get('ALONSO_PROCESS', 0)))
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        host, port = self.address.rsplit(':', 1)
+        reader, self._writer = await asyncio.open_connection(host, int(port))
+        self._send({'op': 'hello', 'process': self.process})
+        self._reader = asyncio.ensure_future(self._read(reader))
+
+    def _send(self, message: dict):
+        if self.connected:
+            self._writer.write(json.dumps(message).encode() + b'\n')
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message['op'] == 'call':
+                    asyncio.ensure_future(self._answer(message))
+                elif message['op'] == 'result':
+                    future = self._pending.get(message['id'])
+                    if future is not None and not future.done():
+                        future.set_result(message['results'])
+        except ConnectionError:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionResetError('launcher connection lost'))
+
+    async def _answer(self, message: dict):
+        handler = self.handlers.get(message['method'])
+        try:
+            result = await handler(*message.get('args', [])) if handler else None
+        except Exception as e:
+            result = {'error': repr(e)}
+
+        self._send({'op': 'reply', 'id': message['id'], 'result': result})
+
+    async def call(self, method: str, *args):
+        if not self.connected:
+            raise ConnectionResetError('not connected to the launcher')
+
+        call_id = next(self._ids)
+        future = self._pending[call_id] = asyncio.get_event_loop().create_future()
+        self._send({'op': 'call', 'id': call_id, 'method': method, 'args': list(args)})
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            del self._pending[call_id]
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class AlonsoBot(commands.AutoShardedBot):
+    """The bot, optionally running only some of its shards.
+
+    Under a ShardLauncher the shard range and the launcher's IPC address come
+    from the environment; run directly, discord.py picks the shard count and
+    every shard runs in this process.
+
+    Command latency, command errors and every Discord API request are timed
+    into ``metrics``, which is served for Prometheus on ``METRICS_ADDRESS``.
+    """
+
+    # host:port of the /metrics endpoint, empty to turn it off. Shard
+    # process N listens on port + N.
+    METRICS_ADDRESS = os.environ.get('ALONSO_METRICS', '127.0.0.1:9100')
+    DATABASE = os.environ.get('ALONSO_DB', 'alonso.db')
+
+    def __init__(self, *args, **kwargs):
+        shard_ids = os.environ.get('ALONSO_SHARD_IDS')
+        if shard_ids:
+            kwargs.setdefault('shard_ids', [int(shard_id) for shard_id in shard_ids.split(',')])
+            kwargs.setdefault('shard_count', int(os.environ['ALONSO_SHARD_COUNT']))
+
+        super().__init__(*args, **kwargs)
+        self.web = WebClient()
+        self.outbox = Outbox()
+        self.store = StateStore(self.DATABASE)
+        self.ipc = ShardLink.from_env()
+        if self.ipc is not None:
+            # Shard processes would clear each other's in-flight downloads and
+            # each fill the whole budget, so every one gets its own slice.
+            cache = YTDLSource.audio_cache
+            cache.directory = os.path.join(cache.directory, str(self.ipc.process))
+            cache.max_bytes //= int(os.environ.get('ALONSO_PROCESSES', 1))
+        self.http.request = self._timed_request(self.http.request)
+        self.watchdog = None
+        self._metrics = None
+
+    @staticmethod
+    def _timed_request(request):
+        @functools.wraps(request)
+        async def timed(route, **kwargs):
+            with metrics.timer('alonso_discord_request_seconds', method=route.method, route=route.path):
+                return await request(route, **kwargs)
+
+        return timed
+
+    async def invoke(self, ctx: commands.Context):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+
+        with metrics.timer('alonso_command_seconds', command=ctx.command.qualified_name):
+            await super().invoke(ctx)
+
+    async def on_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        metrics.inc('alonso_command_errors_total', command=ctx.command.qualified_name if ctx.command else '',
+                    error=type(getattr(error, 'original', error)).__name__)
+        await super().on_command_error(ctx, error)
+
+    async def start(self, *args, **kwargs):
+        if self.ipc is not None:
+            await self.ipc.connect()
+
+        # Stall threshold in ms; unset leaves the watchdog off.
+        threshold = os.environ.get('ALONSO_WATCHDOG')
+        if threshold:
+            self.watchdog = LoopWatchdog(float(threshold) / 1000)
+            self.watchdog.start(self.loop)
+
+        if self.METRICS_ADDRESS:
+            host, port = self.METRICS_ADDRESS.rsplit(':', 1)
+            port = int(port) + (self.ipc.process if self.ipc is not None else 0)
+            try:
+                self._metrics = await metrics.serve(host, port)
+            except OSError as e:
+                print('Metrics endpoint disabled: {}'.format(e))
+
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        if self.ipc is not None:
+            await self.ipc.close()
+
+        if self.watchdog is not None:
+            self.watchdog.stop()
+
+        if self._metrics is not None:
+            await self._metrics.cleanup()
+
+        self.store.close()
+
+        await self.web.close()
+        await super().close()
+
+
+class ShardLauncher:
+    """Runs the bot's shards across several processes and keeps them up.
+
+    Shards ``0 .. shard_count - 1`` are split into contiguous ranges, one per
+    process. Each process is this script started again with its range in
+    the environment. A process that exits is restarted, backing off
+    exponentially while it keeps crashing. The launcher also relays
+    ShardLink calls to every process and collects the replies.
+    """
+
+    def __init__(self, shard_count: int, processes: int, *, reply_timeout: float = 3.0,
+                 max_backoff: float = 60.0):
+        self.shard_count = max(shard_count, processes)
+        size = math.ceil(self.shard_count / processes)
+        self.ranges = [list(range(start, min(start + size, self.shard_count)))
+                       for start in range(0, self.shard_count, size)]
+        self.reply_timeout = reply_timeout
+        self.max_backoff = max_backoff
+
+        self._processes = {}
+        self._links = {}
+        self._replies = {}
+        self._ids = itertools.count()
+        self._stopping = False
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, message: dict):
+        if not writer.is_closing():
+            writer.write(json.dumps(message).encode() + b'\n')
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        process = None
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message['op'] == 'hello':
+                    process = message['process']
+                    self._links[process] = writer
+                elif message['op'] == 'call':
+                    asyncio.ensure_future(self._relay(writer, message))
+                elif message['op'] == 'reply':
+                    future = self._replies.get(message['id'], {}).get(process)
+                    if future is not None and not future.done():
+                        future.set_result(message['result'])
+        except ConnectionError:
+            pass
+        finally:
+            if process is not None and self._links.get(process) is writer:
+                del self._links[process]
+            writer.close()
+
+    async def _relay(self, writer: asyncio.StreamWriter, message: dict):
+        relay_id = next(self._ids)
+        loop = asyncio.get_event_loop()
+        futures = self._replies[relay_id] = {process: loop.create_future() for process in self._links}
+        try:
+            for process, link in list(self._links.items()):
+                self._write(link, {'op': 'call', 'id': relay_id, 'method': message['method'],
+                                   'args': message.get('args', [])})
+            if futures:
+                await asyncio.wait(futures.values(), timeout=self.reply_timeout)
+        finally:
+            del self._replies[relay_id]
+
+        results = [future.result() if future.done() else None for _, future in sorted(futures.items())]
+        self._write(writer, {'op': 'result', 'id': message['id'], 'results': results})
+
+    async def _supervise(self, index: int, shard_ids: list, address: str):
+        env = dict(os.environ,
+                   ALONSO_SHARD_IDS=','.join(map(str, shard_ids)),
+                   ALONSO_SHARD_COUNT=str(self.shard_count),
+                   ALONSO_IPC=address,
+                   ALONSO_PROCESS=str(index),
+                   ALONSO_PROCESSES=str(len(self.ranges)))
+        backoff = 1.0
+        while not self._stopping:
+            started = time.monotonic()
+            process = self._processes[index] = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), env=env)
+            returncode = await process.wait()
+            if self._stopping:
+                return
+
+            if time.monotonic() - started > self.max_backoff:
+                backoff = 1.0
+            print('Shard process {} (shards {}) exited with {}, restarting in {:.0f}s'.format(
+                index, env['ALONSO_SHARD_IDS'], returncode, backoff))
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def serve(self):
+        server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        address = '{}:{}'.format(*server.sockets[0].getsockname()[:2])
+        supervisors = [asyncio.ensure_future(self._supervise(index, shard_ids, address))
+                       for index, shard_ids in enumerate(self.ranges)]
+        try:
+            await asyncio.gather(*supervisors)
+        finally:
+            self._stopping = True
+            for supervisor in supervisors:
+                supervisor.cancel()
+            for process in self._processes.values():
+                if process.returncode is None:
+                    process.terminate()
+            await asyncio.gather(*(process.wait() for process in self._processes.values()),
+                                 return_exceptions=True)
+            server.close()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+
+def fold(text: str):
+    """Case-folds text for trigger matching.
+
+    Dotted and dotless i are folded together, so 'İYİ GECELER', 'IYI
+    GECELER' and 'iyi geceler' all match the same trigger.
+    """
+
+    return text.translate(_FOLD_I).casefold()
+
+
+_FOLD_I = str.maketrans({'I': 'i', 'İ': 'i', 'ı': 'i'})
+
+
+Response = collections.namedtuple('Response', 'content embed file')
+Response.__new__.__defaults__ = (None, None, None)
+
+
+class Trigger:
+    """An auto-response to a word in a message.
+
+    ``mode`` is 'contains', 'equals' or 'startswith'. ``responses`` are sent
+    in order; ``handler`` replaces them for triggers that need the message.
+    Only the first matching trigger of a ``group`` fires, and a trigger fires
+    at most once per ``cooldown`` seconds in a channel.
+    """
+
+    __slots__ = ('pattern', 'mode', 'responses', 'handler', 'group', 'cooldown')
+
+    def __init__(self, pattern: str, *, mode: str = 'contains', responses: tuple = (), handler=None,
+                 group: str = None, cooldown: float = 0.0):
+        if mode not in ('contains', 'equals', 'startswith'):
+            raise ValueError('unknown trigger mode {!r}'.format(mode))
+
+        self.pattern = fold(pattern)
+        self.mode = mode
+        self.responses = tuple(responses)
+        self.handler = handler
+        self.group = group
+        self.cooldown = cooldown
+
+
+class TriggerTable:
+    """Matches every trigger against a message in one pass.
+
+    The patterns are compiled into an Aho-Corasick automaton, so the cost of
+    matching a message depends on its length, not on how many triggers there
+    are. Triggers fire in table order.
+    """
+
+    def __init__(self, triggers: list = (), *, assets: AssetStore = None, outbox: Outbox = None):
+        self.triggers = list(triggers)
+        self.assets = assets
+        self.outbox = outbox
+        self._last_fired = {}
+        self._compile()
+
+    def add(self, trigger: Trigger):
+        self.triggers.append(trigger)
+        self._compile()
+
+    def _compile(self):
+        goto, fail, out = [{}], [0], [[]]
+        for index, trigger in enumerate(self.triggers):
+            node = 0
+            for char in trigger.pattern:
+                if char not in goto[node]:
+                    goto[node][char] = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    out.append([])
+                node = goto[node][char]
+            out[node].append(index)
+
+        queue = collections.deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                out[child] = out[child] + out[fail[child]]
+
+        self._goto, self._fail, self._out = goto, fail, out
+
+    def match(self, text: str):
+        """Returns the triggers matching ``text``, in table order."""
+
+        text = fold(text)
+        goto, fail, out = self._goto, self._fail, self._out
+        triggers = self.triggers
+
+        matched = set()
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for index in out[node]:
+                trigger = triggers[index]
+                if trigger.mode == 'contains':
+                    matched.add(index)
+                elif end + 1 == len(trigger.pattern) and (trigger.mode == 'startswith' or end + 1 == len(text)):
+                    matched.add(index)
+
+        return [triggers[index] for index in sorted(matched)]
+
+    def _ready(self, trigger: Trigger, channel_id: int, now: float):
+        if not trigger.cooldown:
+            return True
+
+        key = (id(trigger), channel_id)
+        if now - self._last_fired.get(key, -math.inf) < trigger.cooldown:
+            return False
+
+        if len(self._last_fired) > 10000:
+            self._last_fired.clear()
+        self._last_fired[key] = now
+        return True
+
+    async def dispatch(self, message: discord.Message):
+        now = time.monotonic()
+        groups = set()
+        for trigger in self.match(message.content):
+            if trigger.group is not None:
+                if trigger.group in groups:
+                    continue
+                groups.add(trigger.group)
+
+            if not self._ready(trigger, message.channel.id, now):
+                continue
+
+            if trigger.handler is not None:
+                await trigger.handler(message)
+                continue
+
+            for response in trigger.responses:
+                if response.file:
+                    await self.assets.send(message.channel, response.file, content=response.content)
+                elif self.outbox is not None:
+                    # Replies to the same message go out together where they can.
+                    self.outbox.post(message.channel, response.content, embed=response.embed)
+                else:
+                    await message.channel.send(response.content, embed=response.embed)
+
+
+bot = AlonsoBot(command_prefix=commands.when_mentioned_or("!"),
+               description='ha pu bottur')
 bot.add_cog(Music(bot))
 
+assets = AssetStore(os.path.dirname(os.path.abspath(__file__)), outbox = bot.outbox)
+assets.load(['space.png', 'erdogan.jpg', 'resim1.png', 'resim2.jpg', 'resim3.jpg', 'resim4.gif'])
+
 
 
 
@@ -503,39 +3530,53 @@ async def on_ready():
     print('Logged in as:\n{0.user.name}\n{0.user.id}'.format(bot))
     await bot.change_presence(activity=discord.Game('Komut listesini görmek için !help yazın'))
 
+    # In the background: the bot already answers while the extraction stack loads.
+    bot.loop.create_task(YTDLSource.engine.warm())
+    if YTDLSource.history is not None:
+        YTDLSource.history.warm(loop = bot.loop)
+
+    # Rejoin and resume the queues that were playing before a restart.
+    bot.get_cog('Music').restore_stored()
+
+OWNER_ID = 666466785771520020
+
+
+async def opucuk(message):
+    if message.author.id == OWNER_ID:
+        await message.channel.send('<:nah:786744888267374642> sana öpücük')
+    else:
+        await assets.send(message.channel, 'resim3.jpg')
+
+async def echo(message):
+    if message.author.id == OWNER_ID:
+        await message.channel.send(message.content[5:].format(message))
+        await message.delete()
+    else:
+        await message.channel.send('Nice try <:nah:786744888267374642>')
+
+
+hamilton_embed = discord.Embed(title = "Eğer hâlâ izlemediyseniz bu videoyu izleyin 🤣", color = 0x00ff00)
+hamilton_embed.add_field(name = 'Link burada <:kral:789265041664245790>: ', value = 'https://www.youtube.com/watch?v=kq2E7LBClnY')
+
+# Yeni bir otomatik cevap eklemek için buraya bir satır eklemek yeterli.
+triggers = TriggerTable([
+    Trigger('hamilton', responses = [Response(embed = hamilton_embed)]),
+    Trigger('iyi geceler', mode = 'equals',
+            responses = [Response('İyi geceler, tatlı rüyalar! <:kral:789265041664245790><:kral:789265041664245790> ')]),
+    Trigger('herkes', group = 'yazım', responses = [Response('*herkez')]),
+    Trigger('boşver', group = 'yazım', responses = [Response(file = 'space.png'), Response('*boş ver')]),
+    Trigger('erdoğan', group = 'yazım', responses = [Response(file = 'erdogan.jpg'), Response('He do be watchin')]),
+    Trigger('öpücük', mode = 'equals', handler = opucuk),
+    Trigger('echo', mode = 'startswith', handler = echo),
+], assets = assets, outbox = bot.outbox)
+
 @bot.event
 async def on_message(message):
-    if 'hamilton' in message.content:
-        myEmbed = discord.Embed(title = "Eğer hâlâ izlemediyseniz bu videoyu izleyin 🤣", color = 0x00ff00)
-        myEmbed.add_field(name = 'Link burada <:kral:789265041664245790>: ', value = 'https://www.youtube.com/watch?v=kq2E7LBClnY')
-        await message.channel.send(embed = myEmbed)
-    await bot.process_commands(message)
-
-    if message.content == "iyi geceler":
-        
-        await message.channel.send('İyi geceler, tatlı rüyalar! <:kral:789265041664245790><:kral:789265041664245790> ')
-
-    if 'herkes' in message.content:
-        await message.channel.send('*herkez')
-    elif 'boşver' in message.content:
-        await message.channel.send(file = discord.File('space.png'))
-        await message.channel.send("*boş ver")
-    elif 'erdoğan' in message.content:
-        await message.channel.send(file = discord.File('erdogan.jpg'))
-        await message.channel.send('He do be watchin')
-    
-    if  message.content == "öpücük":
-        if message.author.id == (666466785771520020):
-            await message.channel.send('<:nah:786744888267374642> sana öpücük')
-        else:
-            await message.channel.send(file = discord.File('resim3.jpg'))
+    if message.author == bot.user:
+        bot.outbox.observe(message)
 
-    if message.content.startswith("echo"):
-        if message.author.id == (666466785771520020):
-            await message.channel.send(message.content[5:].format(message))
-            await message.delete()
-        else:
-            await message.channel.send('Nice try <:nah:786744888267374642>')
+    await bot.process_commands(message)
+    await triggers.dispatch(message)
 
 
 
@@ -555,9 +3596,9 @@ async def bm(context):
 
 @bot.command(name = 'foto')
 async def foto(context):
-    fotolar = ['resim1.png', 'resim2.jpg', 'resim3.jpg', 'resim4.gif' ]
+    fotolar = assets.available(['resim1.png', 'resim2.jpg', 'resim3.jpg', 'resim4.gif' ])
     random_foto = random.choice(fotolar)
-    await context.send(file = discord.File(random_foto))
+    await assets.send(context, random_foto)
 
 @bot.command(name = 'ders')
 async def ders(ctx):
@@ -565,22 +3606,26 @@ async def ders(ctx):
     
     await ctx.channel.send(f"Hadi ders çalışın {study_rol.mention}")
 
-@bot.command(name = 'pikaçu')
-async def pikachu_foto(ctx):
-    """Random pikacu gifi falan atar"""
+pikachu = MediaEndpoint(bot.web, 'https://some-random-api.ml/img/pikachu', key = 'link')
+bot.add_command(pikachu.command('pikaçu', help = 'Random pikacu gifi falan atar'))
+
 
-    URL = 'https://some-random-api.ml/img/pikachu'
-    
-    async with request("GET", URL, headers= {}) as response:
-        if response.status == 200:
-            data = await response.json()
-            await ctx.send(data)
-        
-        else:
-            await ctx.send("Bir sey yanlis gitti")
 
 
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ha pu bottur')
+    parser.add_argument('--processes', type=int, default=1, help='shard processes to launch and supervise')
+    parser.add_argument('--shards', type=int, default=None, help='total shard count (default: one per process)')
+    parser.add_argument('--watchdog', type=float, default=None, metavar='MS',
+                        help='log the stack of anything that blocks the event loop longer than this')
+    args = parser.parse_args()
 
+    if args.watchdog:
+        # Through the environment so shard processes pick it up too.
+        os.environ['ALONSO_WATCHDOG'] = str(args.watchdog)
 
-bot.run("Njk2NjkwNTE1ODczMzY2MDY2.XosZmg.IWO6NBtE_6eWTRmgtI4_s14lPZ0")
\ No newline at end of file
+    if args.processes > 1 and not os.environ.get('ALONSO_SHARD_IDS'):
+        ShardLauncher(args.shards or args.processes, args.processes).run()
+    else:
+        bot.run("Njk2NjkwNTE1ODczMzY2MDY2.XosZmg.IWO6NBtE_6eWTRmgtI4_s14lPZ0")
\ No newline at end of file
@@ -0,0 +1,699 @@
+"""Offline benchmarks for alonso.py.
+
+Nothing here talks to Discord or YouTube; extraction is replayed from the
+recorded info dicts in fixtures/ytdl_info.json.
+
+    python bench.py resolve [--rounds 20] [--latency 150]
+    python bench.py triggers [--sizes 7,100,500,1000]
+    python bench.py media [--requests 50] [--latency 80]
+    python bench.py load [--guilds 2000] [--rate 500] [--duration 10]
+    python bench.py startup [--budget 1500]
+    python bench.py history [--tracks 200000]
+"""
+
+import argparse
+import asyncio
+import collections
+import copy
+import itertools
+import json
+import math
+import os
+import pickle
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import alonso
+from discord.ext import commands
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ytdl_info.json')
+
+
+def load_recordings(path: str = FIXTURES):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class RecordedYoutubeDL:
+    """Stands in for ``youtube_dl.YoutubeDL`` using recorded info dicts.
+
+    Every ``extract_info`` call sleeps for ``latency`` seconds to model the
+    network round trip and deep-copies the recording to model parsing.
+    """
+
+    def __init__(self, recordings: list, *, latency: float = 0.0):
+        self.latency = latency
+        self.params = {}
+        self.calls = 0
+        self.by_query = {alonso.MetadataCache.search_key(r['query']): r['info'] for r in recordings}
+        self.by_url = {r['info']['webpage_url']: r['info'] for r in recordings}
+
+    @staticmethod
+    def _flat(info: dict):
+        return {'_type': 'url', 'ie_key': 'Youtube', 'id': info['id'], 'title': info['title'],
+                'url': info['webpage_url'], 'webpage_url': info['webpage_url']}
+
+    def extract_info(self, url: str, download: bool = False, process: bool = True):
+        self.calls += 1
+        time.sleep(self.latency)
+
+        info = self.by_url.get(url)
+        if info is not None:
+            return copy.deepcopy(info) if process else self._flat(info)
+
+        query = url.split(':', 1)[1] if url.startswith('ytsearch') else url
+        info = self.by_query.get(alonso.MetadataCache.search_key(query))
+        entries = [] if info is None else [copy.deepcopy(info) if process else self._flat(info)]
+        return {'_type': 'playlist', 'entries': iter(entries)}
+
+
+def install_recordings(recordings: list, *, latency: float = 0.0, per_guild: int = 2):
+    """Routes YTDLSource extraction to a RecordedYoutubeDL in this process."""
+
+    ytdl = RecordedYoutubeDL(recordings, latency=latency)
+    alonso.extraction.ytdl = alonso.extraction.flat_ytdl = ytdl
+    # Lookups must all go to the recordings, and the play history would
+    # open the production database in the working directory.
+    alonso.YTDLSource.history = None
+    alonso.YTDLSource.engine = alonso.ExtractionEngine(alonso.YTDLSource.YTDL_OPTIONS, workers=0,
+                                                       per_guild=per_guild)
+    alonso.YTDLSource.cache.clear()
+    return ytdl
+
+
+def percentile(samples: list, pct: float):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(len(ordered) * pct / 100) - 1))
+    return ordered[index]
+
+
+def report(name: str, samples: list, **extra):
+    ms = [s * 1000 for s in samples]
+    fields = ' '.join('{}={}'.format(k, v) for k, v in extra.items())
+    print('{:<12} n={:<5} mean={:8.2f}ms p50={:8.2f}ms p95={:8.2f}ms p99={:8.2f}ms {}'.format(
+        name, len(ms), statistics.mean(ms), percentile(ms, 50), percentile(ms, 95), percentile(ms, 99), fields))
+
+
+async def two_pass(search: str, loop: asyncio.AbstractEventLoop):
+    """The original create_source lookup: flat extract, then a full one."""
+
+    engine = alonso.YTDLSource.engine
+    data = await engine.extract(search, process=False, loop=loop)
+    if 'entries' in data:
+        data = next(entry for entry in data['entries'] if entry)
+
+    info = await engine.extract(data['webpage_url'], loop=loop)
+    if 'entries' in info:
+        info = info['entries'].pop(0)
+
+    return info
+
+
+async def single_pass(search: str, loop: asyncio.AbstractEventLoop):
+    alonso.YTDLSource.cache.clear()
+    return await alonso.YTDLSource.extract_info(search, loop=loop)
+
+
+async def bench_resolve(args):
+    loop = asyncio.get_event_loop()
+    recordings = load_recordings()
+    ytdl = install_recordings(recordings, latency=args.latency / 1000)
+
+    searches = [r['query'] for r in recordings] + [r['info']['webpage_url'] for r in recordings]
+    for name, resolve in (('two-pass', two_pass), ('single-pass', single_pass)):
+        ytdl.calls = 0
+        samples, size = [], 0
+        for _ in range(args.rounds):
+            for search in searches:
+                start = time.perf_counter()
+                info = await resolve(search, loop)
+                samples.append(time.perf_counter() - start)
+                size = max(size, len(pickle.dumps(info)))
+
+        report(name, samples, calls_per_lookup='{:.2f}'.format(ytdl.calls / len(samples)), info_bytes=size)
+
+
+SAMPLE_MESSAGES = [
+    'selam millet bu akşam yarış var mı',
+    'hamilton yine pole aldı ya',
+    'İYİ GECELER',
+    'herkes toplansın ders çalışıyoruz',
+    'boşver ya sonra konuşuruz',
+    '!play tarkan şımarık',
+    'Verstappen ile Hamilton arasındaki fark 0.2 saniye, bence ' * 8,
+    'öpücük',
+]
+
+
+def synthetic_triggers(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    letters = 'abcçdefgğhıijklmnoöprsştuüvyz'
+    triggers = list(alonso.triggers.triggers)
+    while len(triggers) < count:
+        word = ''.join(rng.choice(letters) for _ in range(rng.randint(4, 10)))
+        triggers.append(alonso.Trigger(word, responses=[alonso.Response(word)]))
+
+    return triggers[:max(count, 1)]
+
+
+def naive_match(triggers: list, content: str):
+    """The old on_message style: one scan of the message per trigger."""
+
+    return [t for t in triggers if (t.pattern in content if t.mode == 'contains' else
+                                    content == t.pattern if t.mode == 'equals' else
+                                    content.startswith(t.pattern))]
+
+
+async def bench_triggers(args):
+    messages = SAMPLE_MESSAGES * args.rounds
+    for size in (int(size) for size in args.sizes.split(',')):
+        triggers = synthetic_triggers(size)
+        table = alonso.TriggerTable(triggers)
+
+        start = time.perf_counter()
+        for message in messages:
+            table.match(message)
+        compiled = (time.perf_counter() - start) / len(messages)
+
+        start = time.perf_counter()
+        for message in messages:
+            naive_match(triggers, alonso.fold(message))
+        naive = (time.perf_counter() - start) / len(messages)
+
+        print('{:>5} triggers: compiled {:7.2f}us/message  naive {:7.2f}us/message'.format(
+            size, compiled * 1e6, naive * 1e6))
+
+
+async def standin_api(latency: float):
+    """A local stand-in for a random-media API, answering after ``latency`` seconds."""
+
+    from aiohttp import web
+
+    counter = itertools.count()
+
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return web.json_response({'link': 'https://example.invalid/{}.gif'.format(next(counter))})
+
+    app = web.Application()
+    app.router.add_get('/img/pikachu', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, 'http://{}:{}/img/pikachu'.format(host, port)
+
+
+async def bench_media(args):
+    import aiohttp
+
+    runner, url = await standin_api(args.latency / 1000)
+    try:
+        samples = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            async with aiohttp.request('GET', url) as response:
+                await response.json()
+            samples.append(time.perf_counter() - start)
+            await asyncio.sleep(args.interval / 1000)
+        report('per-call', samples)
+
+        web = alonso.WebClient()
+        endpoint = alonso.MediaEndpoint(web, url, buffer=args.buffer)
+        samples = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            await endpoint.get()
+            samples.append(time.perf_counter() - start)
+            await asyncio.sleep(args.interval / 1000)
+        report('buffered', samples)
+        await web.close()
+    finally:
+        await runner.cleanup()
+
+
+class FakeSource:
+    """What YTDLSource.create_source returns under the load test: no ffmpeg."""
+
+    def __init__(self, song, *, volume: float = 0.5):
+        self.data = song.data
+        self.volume = volume
+        self.position = song.start
+
+    def prebuffer(self, frames: int):
+        pass
+
+    def cleanup(self):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, channel, content: str = '', author=None):
+        self.id = next(FakeTextChannel.ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.author = author
+        self.attachments = []
+
+    async def add_reaction(self, emoji):
+        await self.channel.request()
+
+    async def edit(self, **fields):
+        await self.channel.request()
+
+    async def delete(self):
+        await self.channel.request()
+
+
+class FakeTextChannel:
+    """Counts sends; each API call waits ``latency`` seconds like an HTTP round trip."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, guild, *, latency: float = 0.0):
+        self.id = next(self.ids)
+        self.guild = guild
+        self.latency = latency
+        self.requests = 0
+
+    async def request(self):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    async def send(self, content=None, **fields):
+        await self.request()
+        return FakeMessage(self, content)
+
+
+class FakeVoiceClient:
+    """Stands in for ``discord.VoiceClient``; nothing is encoded or sent."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.source = None
+        self._after = None
+        self._paused = False
+
+    def play(self, source, *, after=None):
+        self.source, self._after, self._paused = source, after, False
+
+    def stop(self):
+        after, self._after, self.source = self._after, None, None
+        if after is not None:
+            after(None)
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def is_playing(self):
+        return self.source is not None and not self._paused
+
+    def is_paused(self):
+        return self.source is not None and self._paused
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+        self.channel.guild.voice_client = None
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild):
+        self.id = next(FakeTextChannel.ids)
+        self.guild = guild
+
+    async def connect(self):
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeContext:
+    """The parts of ``commands.Context`` the Music cog touches."""
+
+    def __init__(self, cog, guild, author, content: str = ''):
+        self.cog = cog
+        self.bot = cog.bot
+        self.guild = guild
+        self.channel = guild.text
+        self.author = author
+        self.message = FakeMessage(guild.text, content, author)
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, **fields):
+        return await self.channel.send(content, **fields)
+
+    def typing(self):
+        return FakeTyping()
+
+    async def invoke(self, command, *args, **kwargs):
+        return await command.callback(self.cog, self, *args, **kwargs)
+
+
+class SimulatedGuild:
+    """A guild with one text channel, one voice channel and a few members in it."""
+
+    ids = itertools.count(10 ** 17)
+
+    def __init__(self, *, members: int = 3, latency: float = 0.0):
+        self.id = next(self.ids)
+        self.roles = []
+        self.voice_client = None
+        self.text = FakeTextChannel(self, latency=latency)
+        self.voice = FakeVoiceChannel(self)
+        self.members = [types.SimpleNamespace(id=self.id + n, mention='<@{}>'.format(self.id + n), bot=False,
+                                              voice=types.SimpleNamespace(channel=self.voice))
+                        for n in range(1, members + 1)]
+
+    def get_member(self, member_id: int):
+        return next((member for member in self.members if member.id == member_id), None)
+
+    def get_channel(self, channel_id: int):
+        return next((channel for channel in (self.text, self.voice) if channel.id == channel_id), None)
+
+
+class LoadTest:
+    """Drives the Music cog and the trigger table the way the gateway would.
+
+    Commands go through the same checks and hooks discord.py runs around
+    them; messages go through the trigger table (command parsing needs a
+    logged-in bot, so on_message is measured from there on).
+    """
+
+    MIX = {'_play': 3, '_queue': 2, '_skip': 2, '_remove': 1, '_shuffle': 1, 'message': 6}
+
+    def __init__(self, cog, guilds: list, searches: list, *, seed: int = 7):
+        self.cog = cog
+        self.guilds = guilds
+        self.searches = searches
+        self.rng = random.Random(seed)
+        self.samples = collections.defaultdict(list)
+
+    async def invoke(self, guild, name: str, *args, **kwargs):
+        ctx = FakeContext(self.cog, guild, self.rng.choice(guild.members), '!' + name.lstrip('_'))
+        command = getattr(self.cog, name)
+
+        start = time.perf_counter()
+        try:
+            self.cog.cog_check(ctx)
+            await self.cog.cog_before_invoke(ctx)
+            if name == '_play':
+                await self.cog.ensure_voice_state(ctx)
+            await command.callback(self.cog, ctx, *args, **kwargs)
+        except commands.CommandError as e:
+            await self.cog.cog_command_error(ctx, e)
+        self.samples[name].append(time.perf_counter() - start)
+
+    async def message(self, guild):
+        message = FakeMessage(guild.text, self.rng.choice(SAMPLE_MESSAGES), self.rng.choice(guild.members))
+
+        start = time.perf_counter()
+        await alonso.triggers.dispatch(message)
+        self.samples['on_message'].append(time.perf_counter() - start)
+
+    async def step(self):
+        guild = self.rng.choice(self.guilds)
+        name = self.rng.choices(list(self.MIX), weights=list(self.MIX.values()))[0]
+
+        if name == 'message':
+            await self.message(guild)
+        elif name == '_play':
+            await self.invoke(guild, name, search=self.rng.choice(self.searches))
+        elif name == '_remove':
+            state = self.cog.voice_states.get(guild.id)
+            queued = len(state.songs) if state else 0
+            await self.invoke(guild, name, self.rng.randint(1, max(queued, 1)))
+        else:
+            await self.invoke(guild, name)
+
+    async def populate(self, songs: int):
+        """Queues ``songs`` tracks in every guild; returns traced bytes per guild."""
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for guild in self.guilds:
+            for _ in range(songs):
+                await self.invoke(guild, '_play', search=self.rng.choice(self.searches))
+        await asyncio.sleep(0.1)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        self.samples.clear()
+        return used / len(self.guilds)
+
+    async def run(self, rate: float, duration: float):
+        loop = asyncio.get_event_loop()
+        lag, running = [], set()
+        monitor = loop.create_task(measure_lag(lag))
+
+        deadline = loop.time() + duration
+        while loop.time() < deadline:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            task = loop.create_task(self.step())
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+        if running:
+            await asyncio.wait(running)
+        monitor.cancel()
+        return lag
+
+    async def close(self):
+        await asyncio.gather(*(state.close() for state in list(self.cog.voice_states.values())))
+
+
+async def measure_lag(samples: list, interval: float = 0.05):
+    """Records how late each ``interval`` sleep wakes up, i.e. event-loop lag."""
+
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def bench_load(args):
+    recordings = load_recordings()
+    install_recordings(recordings, latency=args.latency / 1000, per_guild=2)
+    alonso.YTDLSource.create_source = classmethod(lambda cls, song, *, volume=0.5: FakeSource(song, volume=volume))
+    scratch = tempfile.mkdtemp()
+    alonso.YTDLSource.audio_cache = alonso.AudioCache(scratch, min_plays=sys.maxsize)
+    alonso.bot.store.path = os.path.join(scratch, 'alonso.db')
+
+    cog = alonso.bot.get_cog('Music')
+    cog.voice_states.max_states = max(cog.voice_states.max_states, args.guilds)
+    guilds = [SimulatedGuild(latency=args.send_latency / 1000) for _ in range(args.guilds)]
+    searches = [r['query'] for r in recordings] + [r['info']['webpage_url'] for r in recordings]
+    test = LoadTest(cog, guilds, searches)
+
+    per_guild = await test.populate(args.queue)
+    print('memory       {:.1f} KiB/guild with {} queued songs ({} guilds)'.format(
+        per_guild / 1024, args.queue, args.guilds))
+
+    watchdog = None
+    if args.watchdog:
+        watchdog = alonso.LoopWatchdog(args.watchdog / 1000)
+        watchdog.start()
+
+    lag = await test.run(args.rate, args.duration)
+    if watchdog is not None:
+        watchdog.stop()
+    for name, samples in sorted(test.samples.items()):
+        report(name, samples)
+    report('loop lag', lag)
+
+    stats = cog.voice_states.stats()
+    print(' '.join('{}={}'.format(k, v) for k, v in stats.items()),
+          'api_requests={}'.format(sum(guild.text.requests for guild in guilds)))
+    if watchdog is not None:
+        for site, seconds in watchdog.hotspots.most_common(5):
+            print('blocked {:7.1f}ms  {}'.format(seconds * 1000, site))
+    await test.close()
+
+
+IMPORT_TIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)')
+
+
+def import_times(module: str):
+    """Imports ``module`` in a fresh interpreter under ``-X importtime``.
+
+    Returns the process wall time, the module's cumulative import time and
+    the cumulative time of each of its direct imports, all in seconds.
+    """
+
+    env = dict(os.environ, ALONSO_METRICS='')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total, children = 0.0, collections.Counter()
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match is None:
+            continue
+
+        cumulative, depth, name = int(match.group(2)) / 1e6, len(match.group(3)) // 2, match.group(4)
+        if depth == 0 and name == module:
+            total = cumulative
+        elif depth == 1:
+            children[name.split('.')[0]] += cumulative
+
+    return wall, total, children
+
+
+async def bench_startup(args):
+    wall, total, children = import_times('alonso')
+    print('import alonso: {:.0f}ms (process {:.0f}ms)'.format(total * 1000, wall * 1000))
+    for name, seconds in children.most_common(args.top):
+        print('  {:<24} {:7.1f}ms'.format(name, seconds * 1000))
+
+    if 'youtube_dl' in children:
+        print('youtube_dl is imported at startup; it should only load in the extraction workers')
+    else:
+        try:
+            _, deferred, _ = import_times('youtube_dl')
+        except RuntimeError as e:
+            print('youtube_dl: not measured ({})'.format(e))
+        else:
+            print('youtube_dl: {:.0f}ms, deferred to the extraction workers'.format(deferred * 1000))
+
+    if total * 1000 > args.budget:
+        print('over budget: {:.0f}ms > {:.0f}ms'.format(total * 1000, args.budget))
+        sys.exit(1)
+
+
+def synthetic_tracks(recordings: list, count: int, seed: int = 7):
+    """The recorded tracks plus made-up ones, as (url, title, uploader, tags) rows."""
+
+    rng = random.Random(seed)
+    letters = 'abcçdefgğhıijklmnoöprsştuüvyz'
+    words = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(count // 4 + 100)]
+    artists = [' '.join(rng.sample(words, 2)).title() for _ in range(count // 20 + 10)]
+    rows = [(r['info']['webpage_url'], r['info']['title'], r['info'].get('uploader'),
+             ' '.join((r['info'].get('tags') or [])[:alonso.PlayHistory.TAGS])) for r in recordings]
+    while len(rows) < count:
+        artist = rng.choice(artists)
+        title = '{} - {}{}'.format(artist, ' '.join(rng.sample(words, rng.randint(1, 4))).title(),
+                                   rng.choice(['', ' (Official Video)', ' (Lyrics)', ' [Live]']))
+        rows.append(('https://www.youtube.com/watch?v={:011d}'.format(len(rows)), title, artist,
+                     ' '.join(rng.sample(words, rng.randint(0, 5)))))
+
+    return rows
+
+
+async def bench_history(args):
+    recordings = load_recordings()
+    store = alonso.StateStore(os.path.join(tempfile.mkdtemp(), 'alonso.db'))
+    rows = synthetic_tracks(recordings, args.tracks)
+    with store.db:
+        store.db.executemany('INSERT OR IGNORE INTO tracks (url, title, uploader, tags) VALUES (?, ?, ?, ?)', rows)
+
+    history = alonso.PlayHistory(store)
+    tracemalloc.start()
+    start = time.perf_counter()
+    await history.warm()
+    build = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('index        {} tracks in {:.2f}s, {:.1f} MiB ({:.0f} B/track)'.format(
+        len(history), build, memory / 2 ** 20, memory / max(len(history), 1)))
+
+    rng = random.Random(7)
+    sample = rng.sample(rows, min(args.queries, len(rows)))
+    for url, title, uploader, tags in sample[:len(sample) // 2]:
+        for _ in range(rng.randint(1, 5)):
+            await history.record(1, {'webpage_url': url, 'title': title, 'uploader': uploader, 'tags': tags.split()})
+
+    suggest, lookup, hits = [], [], 0
+    for url, title, _, _ in sample:
+        words = title.split()
+        partial = ' '.join(words[:-1] + [words[-1][:3]])
+        start = time.perf_counter()
+        await history.suggest(1, partial)
+        suggest.append(time.perf_counter() - start)
+
+        # Typed the way people type: lowercase, no Turkish letters, no decorations.
+        typed = alonso.PlayHistory.tokens(title.split('(')[0].split('[')[0])
+        start = time.perf_counter()
+        hits += await history.lookup(1, ' '.join(typed)) == url
+        lookup.append(time.perf_counter() - start)
+
+    report('suggest', suggest)
+    report('lookup', lookup, resolved='{}/{}'.format(hits, len(sample)))
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    resolve = sub.add_parser('resolve', help='two-pass vs single-pass track resolution')
+    resolve.add_argument('--rounds', type=int, default=20)
+    resolve.add_argument('--latency', type=float, default=150, help='simulated extractor round trip in ms')
+    resolve.set_defaults(func=bench_resolve)
+
+    triggers = sub.add_parser('triggers', help='per-message cost of on_message trigger matching')
+    triggers.add_argument('--sizes', default='7,100,500,1000', help='comma-separated trigger table sizes')
+    triggers.add_argument('--rounds', type=int, default=500)
+    triggers.set_defaults(func=bench_triggers)
+
+    media = sub.add_parser('media', help='per-call aiohttp.request vs pooled, prefetched MediaEndpoint')
+    media.add_argument('--requests', type=int, default=50)
+    media.add_argument('--latency', type=float, default=80, help='stand-in API latency in ms')
+    media.add_argument('--interval', type=float, default=200, help='pause between invocations in ms')
+    media.add_argument('--buffer', type=int, default=5)
+    media.set_defaults(func=bench_media)
+
+    load = sub.add_parser('load', help='mixed Music commands and chat across many simulated guilds')
+    load.add_argument('--guilds', type=int, default=2000)
+    load.add_argument('--queue', type=int, default=3, help='songs queued per guild before the run')
+    load.add_argument('--rate', type=float, default=500, help='commands and messages per second')
+    load.add_argument('--duration', type=float, default=10, help='seconds of load')
+    load.add_argument('--latency', type=float, default=20, help='simulated extractor round trip in ms')
+    load.add_argument('--send-latency', type=float, default=0, help='simulated Discord API round trip in ms')
+    load.add_argument('--watchdog', type=float, default=None, metavar='MS',
+                      help='sample the stack of event-loop stalls longer than this')
+    load.set_defaults(func=bench_load)
+
+    startup = sub.add_parser('startup', help='cold start import breakdown against a budget')
+    startup.add_argument('--budget', type=float, default=1500, help='maximum import time of alonso in ms')
+    startup.add_argument('--top', type=int, default=10, help='how many of the slowest imports to list')
+    startup.set_defaults(func=bench_startup)
+
+    history = sub.add_parser('history', help='play history index size and search latency')
+    history.add_argument('--tracks', type=int, default=200000)
+    history.add_argument('--queries', type=int, default=1000)
+    history.set_defaults(func=bench_history)
+
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
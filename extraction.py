@@ -0,0 +1,105 @@
+"""youtube_dl extraction for alonso.py's worker processes.
+
+Workers are spawned, so they import whatever module their functions live
+in; this one has no side effects and leaves the bot, its cogs and its
+assets to the parent process.
+"""
+
+import itertools
+
+
+class YTDLError(Exception):
+    pass
+
+
+_youtube_dl = None
+ytdl = None
+flat_ytdl = None
+
+
+def load_youtube_dl():
+    """Imports youtube_dl on first use.
+
+    It's a big package with hundreds of extractor modules and only the
+    extraction workers need it, so the bot itself starts without it.
+    """
+
+    global _youtube_dl
+
+    if _youtube_dl is None:
+        import youtube_dl
+
+        # Silence useless bug reports messages
+        youtube_dl.utils.bug_reports_message = lambda: ''
+        _youtube_dl = youtube_dl
+
+    return _youtube_dl
+
+
+def init(options: dict):
+    global ytdl, flat_ytdl
+
+    youtube_dl = load_youtube_dl()
+    ytdl = youtube_dl.YoutubeDL(options)
+    flat_ytdl = youtube_dl.YoutubeDL(dict(options, extract_flat='in_playlist', noplaylist=False))
+
+
+def _trim_info(info: dict, fields: tuple):
+    if info is None or fields is None:
+        return info
+
+    return {key: info[key] for key in fields if key in info}
+
+
+def extract(url: str, process: bool, fields: tuple = None):
+    try:
+        data = ytdl.extract_info(url, download=False, process=process)
+    except load_youtube_dl().utils.YoutubeDLError as e:
+        # youtube_dl errors carry tracebacks that don't survive pickling.
+        raise YTDLError(str(e)) from None
+
+    if data is not None and 'entries' in data:
+        data['entries'] = [_trim_info(entry, fields) for entry in data['entries']]
+        return data
+
+    return _trim_info(data, fields)
+
+
+def _flat_entry_url(entry: dict):
+    url = entry.get('webpage_url') or entry.get('url')
+    if url and '://' not in url and entry.get('ie_key') == 'Youtube':
+        url = 'https://www.youtube.com/watch?v=' + url
+
+    return url
+
+
+def extract_playlist(url: str, limit: int):
+    """Returns the playlist's title, up to ``limit`` (url, title) pairs and whether it was cut short."""
+
+    # youtube_dl stops fetching pages at playlistend; one extra entry tells
+    # whether there was more.
+    flat_ytdl.params['playlistend'] = limit + 1
+    try:
+        data = flat_ytdl.extract_info(url, download=False)
+    except load_youtube_dl().utils.YoutubeDLError as e:
+        raise YTDLError(str(e)) from None
+
+    if data is None:
+        return None
+
+    # Only (url, title) pairs cross the process boundary; everything else
+    # is resolved per song once it gets close to the play head.
+    entries, truncated = [], False
+    for index, entry in enumerate(itertools.islice(data.get('entries') or (), limit + 1)):
+        if index == limit:
+            truncated = True
+            break
+
+        if not entry or entry.get('title') in ('[Private video]', '[Deleted video]'):
+            continue
+
+        url = _flat_entry_url(entry)
+        if url:
+            entries.append((url, entry.get('title')))
+
+    return data.get('title'), entries, truncated